@@ -0,0 +1,228 @@
+"""ASGI entry point serving /<short_code> and /api/urls on an event loop.
+
+    uvicorn asgi:app
+
+Request handling is shared with the Flask app in urshortner, so both give
+the same status codes and bodies. Anything that can touch the disk (store
+writes, and reads on backends that aren't in memory) runs in a thread pool
+so it never blocks the loop.
+"""
+
+import asyncio
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import BadRequest, Gone, MethodNotAllowed, NotFound, UnsupportedMediaType
+from werkzeug.http import parse_accept_header
+
+import urshortner
+
+
+# Threads used for persistence and on-disk reads
+THREADS = int(os.environ.get("URL_ASGI_THREADS", "32"))
+
+executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="asgi-store")
+
+# Lines pulled from the store per executor hop when streaming NDJSON
+STREAM_CHUNK = 500
+
+
+def offload(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+def json_body(body, status):
+    # Same output as flask.jsonify outside debug mode
+    data = json.dumps(body, sort_keys=True, separators=(",", ":")) + "\n"
+    return data.encode("utf-8"), status, [("Content-Type", "application/json")]
+
+
+def error_body(exc, allowed=None):
+    response = exc.get_response()
+    if allowed:
+        response.headers["Allow"] = ", ".join(allowed)
+    return response.get_data(), response.status_code, list(response.headers)
+
+
+def too_many_requests(wait):
+    body, status, headers = json_body(dict(error="Too many requests"), 429)
+    return body, status, headers + [("Retry-After", str(math.ceil(wait)))]
+
+
+async def send_response(send, body, status, headers):
+    headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers
+               if k.lower() != "content-length"]
+    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_stream(send, lines):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/x-ndjson")],
+    })
+    while True:
+        chunk = await offload(lambda: list(itertools.islice(lines, STREAM_CHUNK)))
+        if not chunk:
+            break
+        await send({"type": "http.response.body", "body": "".join(chunk).encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def without_body(send):
+    # HEAD responses keep their headers but send no body
+    async def wrapped(message):
+        if message["type"] == "http.response.body":
+            message = dict(message, body=b"")
+        await send(message)
+    return wrapped
+
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+async def handle_redirect(scope, send, short_code):
+    client = scope.get("client")
+    remote_addr = client[0] if client else None
+    api_key = header(scope, b"x-api-key") or None
+    wait = urshortner.rate_limit("redirect", remote_addr, api_key)
+    if wait:
+        await send_response(send, *too_many_requests(wait))
+        return
+    visitor = urshortner.visitor_id(remote_addr, header(scope, b"user-agent"))
+    if urshortner.store.in_memory:
+        parts = urshortner.redirect_parts(short_code, visitor)
+    else:
+        parts = await offload(urshortner.redirect_parts, short_code, visitor)
+    if parts is None:
+        urshortner.note_not_found(remote_addr, api_key)
+        parts = error_body(NotFound())
+    elif parts is urshortner.GONE:
+        parts = error_body(Gone())
+    await send_response(send, *parts)
+
+
+async def handle_api(scope, receive, send):
+    method = scope["method"]
+    if method in ("GET", "HEAD", "POST", "PUT", "DELETE"):
+        client = scope.get("client")
+        wait = urshortner.rate_limit("shorten" if method == "POST" else "api",
+                                     client[0] if client else None, header(scope, b"x-api-key") or None)
+        if wait:
+            await send_response(send, *too_many_requests(wait))
+            return
+    if method in ("GET", "HEAD"):
+        args = dict(parse_qsl(scope["query_string"].decode("latin-1")))
+        accept = parse_accept_header(header(scope, b"accept"), MIMEAccept).best
+        body, status = await offload(urshortner.list_urls, args, accept)
+        if isinstance(body, dict):
+            await send_response(send, *json_body(body, status))
+        else:
+            await send_stream(send, body)
+        return
+
+    if method not in ("POST", "PUT", "DELETE"):
+        await send_response(send, *error_body(MethodNotAllowed(), ["DELETE", "GET", "HEAD", "OPTIONS", "POST", "PUT"]))
+        return
+
+    # Same checks flask.Request.json makes
+    content_type = header(scope, b"content-type").split(";")[0].strip().lower()
+    if not (content_type == "application/json" or
+            (content_type.startswith("application/") and content_type.endswith("+json"))):
+        await send_response(send, *error_body(UnsupportedMediaType()))
+        return
+    try:
+        data = json.loads(await read_body(receive))
+    except ValueError:
+        await send_response(send, *error_body(BadRequest()))
+        return
+
+    if method == "POST":
+        expires_at, error = urshortner.parse_expiry(data)
+        if not error:
+            policy, error = urshortner.parse_policy(data)
+        if error:
+            await send_response(send, *json_body(dict(error=error), 400))
+            return
+        if expires_at is urshortner.MISSING:
+            expires_at = None
+        body, status = await offload(urshortner.create_link, data.get("originalUrl", ""), expires_at, policy)
+    elif method == "PUT":
+        body, status = await offload(urshortner.update_link, data.get("shortCode"), data)
+    else:
+        body, status = await offload(urshortner.delete_link, data.get("shortCode"))
+    await send_response(send, *json_body(body, status))
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "HEAD":
+        send = without_body(send)
+    if urshortner.metrics is None:
+        await dispatch(scope, receive, send)
+        return
+    started = time.perf_counter()
+    status = [500]
+
+    async def observed(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+        await send(message)
+
+    route = await dispatch(scope, receive, observed)
+    urshortner.observe_request(route, scope["method"], status[0], time.perf_counter() - started)
+
+
+async def dispatch(scope, receive, send):
+    # Serve the request; returns the name of the Flask endpoint it matched
+    path = scope["path"]
+    if path == "/api/urls":
+        await handle_api(scope, receive, send)
+        return "api_urls"
+    if path == "/metrics" and urshortner.metrics is not None:
+        body = (await offload(urshortner.metrics.render)).encode("utf-8")
+        await send_response(send, body, 200, [("Content-Type", "text/plain; version=0.0.4")])
+        return "metrics_page"
+    if path.count("/") == 1 and len(path) > 1:
+        if scope["method"] in ("GET", "HEAD"):
+            await handle_redirect(scope, send, path[1:])
+        else:
+            await send_response(send, *error_body(MethodNotAllowed(), ["GET", "HEAD", "OPTIONS"]))
+        return "redirect_to_url"
+    await send_response(send, *error_body(NotFound()))
+    return "unmatched"
@@ -0,0 +1,54 @@
+import gzip
+import hashlib
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class PrecompressedAsset:
+    # A fixed response body with its gzip and (if the brotli package is
+    # installed) Brotli encodings computed once up front. Each encoding gets
+    # its own strong ETag, and matching If-None-Match requests get a 304.
+
+    def __init__(self, body, content_type, max_age=300):
+        self.content_type = content_type
+        self.cache_control = "public, max-age=%d" % max_age
+        self.variants = {"identity": body}
+        compressed = {"gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        for encoding, data in compressed.items():
+            if len(data) < len(body):
+                self.variants[encoding] = data
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etags = {
+            encoding: digest if encoding == "identity" else "%s-%s" % (digest, encoding)
+            for encoding in self.variants
+        }
+
+    def choose_encoding(self, accept_encodings):
+        best, best_quality = "identity", 0
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants:
+                quality = accept_encodings[encoding]
+                if quality > best_quality:
+                    best, best_quality = encoding, quality
+        return best
+
+    def respond(self, request):
+        encoding = self.choose_encoding(request.accept_encodings)
+        etag = self.etags[encoding]
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding], content_type=self.content_type)
+            if encoding != "identity":
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = self.cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
@@ -0,0 +1,94 @@
+import codecs
+import json
+
+
+READ_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+
+# Stands in for the rest of a body that failed to parse
+MALFORMED = object()
+
+
+def iter_ndjson(stream):
+    # One JSON value per line; blank lines are skipped
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_json_array(stream):
+    # Yield the elements of a top-level JSON array without reading the whole
+    # body into memory first. Only one element is buffered at a time.
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    # What comes next: "[", the first element or "]", an element (after a
+    # comma), or a comma or "]" (after an element)
+    expect = "start"
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+        if pos < len(buf):
+            char = buf[pos]
+            if expect == "start":
+                if char != "[":
+                    raise ValueError("Expected a JSON array")
+                expect = "first"
+                pos += 1
+                continue
+            if expect == "separator":
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError("Expected ',' or ']' after an array element")
+                expect = "element"
+                pos += 1
+                continue
+            if char == "]" and expect == "first":
+                return
+            if char in ",]":
+                raise ValueError("Expected an array element")
+            try:
+                value, end = _decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # A number at the very end of the buffer may be cut short
+                if end < len(buf) or eof:
+                    yield value
+                    expect = "separator"
+                    pos = end
+                    continue
+        if eof:
+            raise ValueError("Unterminated JSON array")
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            eof = True
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk, final=eof)
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def guarded(items):
+    # Stop at the first malformed element and report it in-band, so the
+    # elements already read still get applied.
+    try:
+        yield from items
+    except ValueError:
+        yield MALFORMED
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
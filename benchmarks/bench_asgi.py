@@ -0,0 +1,128 @@
+"""Requests/sec and latency of the ASGI entry point next to the WSGI app.
+
+Both are driven in-process with no network: the ASGI app through direct
+scope/receive/send calls on one event loop, the WSGI app through its WSGI
+callable from a pool of threads (one per concurrent connection). The mix is
+mostly redirects to seeded codes with some POSTs.
+
+    python benchmarks/bench_asgi.py --requests 20000 --concurrency 1000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bench-asgi-"))
+
+from werkzeug.test import EnvironBuilder  # noqa: E402
+
+import asgi  # noqa: E402
+import urshortner  # noqa: E402
+
+
+def make_plan(codes, requests, write_ratio, prefix, seed=1):
+    # POSTs go to URLs under prefix, which each run must keep to itself:
+    # URLs the other run already shortened would be answered by dedup
+    # without a write
+    rng = random.Random(seed)
+    plan = []
+    for i in range(requests):
+        if rng.random() < write_ratio:
+            plan.append(("POST", "/api/urls", {"originalUrl": "https://example.com/%s/%d" % (prefix, i)}))
+        else:
+            plan.append(("GET", "/" + rng.choice(codes), None))
+    return plan
+
+
+def summarize(name, latencies, elapsed):
+    latencies.sort()
+    n = len(latencies)
+    return {
+        "server": name,
+        "requests": n,
+        "rps": n / elapsed,
+        "p50_ms": latencies[n // 2] * 1000,
+        "p99_ms": latencies[min(n - 1, int(n * 0.99))] * 1000,
+    }
+
+
+def run_wsgi(plan, concurrency):
+    wsgi_app = urshortner.app.wsgi_app
+
+    def one(item):
+        method, path, body = item
+        builder = EnvironBuilder(path=path, method=method, json=body)
+        environ = builder.get_environ()
+        started = time.perf_counter()
+        result = wsgi_app(environ, lambda status, headers, exc_info=None: None)
+        b"".join(result)
+        if hasattr(result, "close"):
+            result.close()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, plan))
+    return summarize("wsgi", latencies, time.perf_counter() - started)
+
+
+async def run_asgi_async(plan, concurrency):
+    queue = list(reversed(plan))
+    latencies = []
+
+    async def one(method, path, body):
+        headers = [(b"content-type", b"application/json")] if body is not None else []
+        messages = [{"type": "http.request", "body": json.dumps(body).encode() if body else b""}]
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        scope = {"type": "http", "method": method, "path": path, "query_string": b"", "headers": headers}
+        started = time.perf_counter()
+        await asgi.app(scope, receive, send)
+        latencies.append(time.perf_counter() - started)
+
+    async def connection():
+        while queue:
+            await one(*queue.pop())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection() for _ in range(concurrency)))
+    return summarize("asgi", latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--links", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    codes = []
+    with urshortner.store.batch():
+        for i in range(args.links):
+            body, _ = urshortner.create_link("https://example.com/seed/%d" % i)
+            codes.append(body["shortCode"])
+
+    results = [
+        run_wsgi(make_plan(codes, args.requests, args.write_ratio, "wsgi", seed=1), args.concurrency),
+        asyncio.run(run_asgi_async(make_plan(codes, args.requests, args.write_ratio, "asgi", seed=2), args.concurrency)),
+    ]
+    print("%-6s %10s %10s %10s" % ("server", "req/s", "p50 ms", "p99 ms"))
+    for r in results:
+        print("%-6s %10.0f %10.2f %10.2f" % (r["server"], r["rps"], r["p50_ms"], r["p99_ms"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Memory per link for the dict-of-dicts store against CompactTable, plus
+the cost of a lookup in each.
+
+    python benchmarks/bench_compactstore.py --links 1000000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codegen import ALPHABET  # noqa: E402
+from compactstore import CompactTable  # noqa: E402
+
+
+def links(count, seed=1):
+    # Short codes are the 6-character kind the allocator hands out; URLs
+    # are built per link so neither layout gets to share string objects.
+    rng = random.Random(seed)
+    now = time.time()
+    for i in range(count):
+        code = "".join(rng.choice(ALPHABET) for _ in range(6))
+        url = "https://example.com/articles/%d/%s" % (i, "".join(rng.choice(ALPHABET) for _ in range(12)))
+        yield code, {"originalUrl": url, "createdAt": now - i, "archived": i % 20 == 0}
+
+
+def measure(factory, count):
+    gc.collect()
+    tracemalloc.start()
+    table = factory()
+    for code, details in links(count):
+        table[code] = details
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    codes = [code for code, _ in links(min(count, 100000), seed=1)]
+    started = time.perf_counter()
+    for code in codes:
+        table.get(code)
+    lookup = (time.perf_counter() - started) / len(codes)
+    return table, size, lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--links", type=int, default=200000)
+    args = parser.parse_args()
+
+    print("%-14s %12s %12s %12s" % ("layout", "total MB", "bytes/link", "get us"))
+    for name, factory in (("dict of dicts", dict), ("CompactTable", CompactTable)):
+        table, size, lookup = measure(factory, args.links)
+        print("%-14s %12.1f %12.0f %12.2f" % (
+            name, size / 1e6, size / len(table), lookup * 1e6))
+        del table
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""POST /api/urls throughput as writer threads are added, with the store
+split over 1 shard (the old single-lock behaviour) and over N shards.
+
+    python benchmarks/bench_contention.py --requests 4000 --shards 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bench-contention-"))
+
+import urshortner  # noqa: E402
+from storage import JsonStore  # noqa: E402
+
+
+def run(threads, shards, requests):
+    urshortner.store = JsonStore("bench_%d_%d.json" % (threads, shards), shards=shards)
+    per_thread = requests // threads
+    start_gate = threading.Barrier(threads + 1)
+
+    def worker(n):
+        client = urshortner.app.test_client()
+        start_gate.wait()
+        for i in range(per_thread):
+            url = "https://example.com/%d/%d/%d" % (shards, n, i)
+            client.post("/api/urls", json={"originalUrl": url})
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    start_gate.wait()
+    started = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    urshortner.store.close()
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--threads", default="1,2,4,8,16")
+    args = parser.parse_args()
+
+    print("%8s %14s %14s" % ("threads", "1 shard req/s", "%d shards req/s" % args.shards))
+    for threads in [int(t) for t in args.threads.split(",")]:
+        single = run(threads, 1, args.requests)
+        striped = run(threads, args.shards, args.requests)
+        print("%8d %14.0f %14.0f" % (threads, single, striped))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Journal write throughput at each durability level as writer threads are
+added. Records from concurrent writers are committed in groups, so the
+records-per-group column shows how much work each flush/fsync covers.
+
+    python benchmarks/bench_durability.py --writes 5000 --threads 1,8,32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import DURABILITY  # noqa: E402
+from storage import JsonStore  # noqa: E402
+
+
+def run(directory, durability, threads, writes):
+    path = os.path.join(directory, "bench_%s_%d.json" % (durability, threads))
+    store = JsonStore(path, durability=durability, max_queued=1 << 30)
+    per_thread = writes // threads
+    start_gate = threading.Barrier(threads + 1)
+
+    def worker(n):
+        start_gate.wait()
+        for i in range(per_thread):
+            code = "t%d-%d" % (n, i)
+            store.put(code, {"originalUrl": "https://example.com/%s" % code, "createdAt": 0.0, "archived": False})
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    start_gate.wait()
+    started = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    # Acknowledged is not necessarily written in async mode; report both
+    store.close()
+    drained = time.perf_counter() - started
+    groups = store.journal.groups
+    return per_thread * threads / elapsed, per_thread * threads / drained, per_thread * threads / max(groups, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writes", type=int, default=5000)
+    parser.add_argument("--threads", default="1,8,32")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench-durability-")
+    print("%-8s %8s %14s %14s %12s" % ("mode", "threads", "acked w/s", "drained w/s", "recs/group"))
+    for durability in DURABILITY:
+        for threads in [int(t) for t in args.threads.split(",")]:
+            acked, written, per_group = run(directory, durability, threads, args.writes)
+            print("%-8s %8d %14.0f %14.0f %12.1f" % (durability, threads, acked, written, per_group))
+
+
+if __name__ == "__main__":
+    main()
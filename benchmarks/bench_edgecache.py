@@ -0,0 +1,136 @@
+"""Origin hits saved by per-link redirect caching, behind a stand-in edge
+cache that follows the purge log.
+
+The edge keeps redirects for as long as their Cache-Control max-age allows
+and indexes them by Surrogate-Key. Every --poll requests it reads
+/api/purges and drops what the log names. Traffic is Zipf-skewed redirects
+with a share of PUTs that move links to new URLs, run once with links that
+set no maxAge and once with --max-age. The origin is the Flask app in
+process, with no network.
+
+Stale responses are redirects served from the edge after an update. They
+are bounded by the poll interval: they can only happen between an update
+and the next poll.
+
+    python benchmarks/bench_edgecache.py --links 10000 --requests 200000 --max-age 3600
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bench-edge-"))
+os.environ.setdefault("URL_PURGE_LOG", "url_data.purge")
+os.environ.setdefault("URL_CLICKS", "0")
+
+import urshortner  # noqa: E402
+
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class EdgeCache:
+    # A caching proxy's redirect handling: cache 301/302/307/308 for their
+    # max-age, purge by surrogate key from the origin's purge log
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.entries = {}
+        self.by_key = {}
+        self.position = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, now):
+        entry = self.entries.get(path)
+        if entry is not None and now < entry[0]:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        response = self.origin.get(path)
+        location = response.headers.get("Location")
+        match = MAX_AGE.search(response.headers.get("Cache-Control", ""))
+        if response.status_code in (301, 302, 307, 308) and match and int(match.group(1)) > 0:
+            self.entries[path] = (now + int(match.group(1)), response.status_code, location)
+            for key in response.headers.get("Surrogate-Key", "").split():
+                self.by_key.setdefault(key, set()).add(path)
+        return response.status_code, location
+
+    def poll(self):
+        # Purge everything named in the log since the last poll
+        while True:
+            body = self.origin.get("/api/purges?after=%d" % self.position).json
+            for entry in body["purges"]:
+                for path in self.by_key.pop("link:" + entry["shortCode"], ()):
+                    self.entries.pop(path, None)
+            if body["next"] == self.position:
+                return
+            self.position = body["next"]
+
+
+def run(client, codes, args, max_age, seed):
+    rng = random.Random(seed)
+    weights = list(itertools.accumulate(1 / (k ** args.zipf) for k in range(1, len(codes) + 1)))
+    for code in codes:
+        client.put("/api/urls", json={"shortCode": code, "maxAge": max_age})
+    edge = EdgeCache(client)
+    edge.poll()
+    current = {}
+    stale = 0
+    started = time.perf_counter()
+    for i in range(args.requests):
+        code = codes[min(bisect.bisect_left(weights, rng.random() * weights[-1]), len(codes) - 1)]
+        if rng.random() < args.update_rate:
+            url = "https://example.com/moved/%d" % i
+            client.put("/api/urls", json={"shortCode": code, "originalUrl": url})
+            current[code] = url
+        else:
+            _, location = edge.get("/" + code, time.monotonic())
+            if code in current and location != current[code]:
+                stale += 1
+        if i % args.poll == 0:
+            edge.poll()
+    return {
+        "max_age": max_age,
+        "edge_hits": edge.hits,
+        "origin_hits": edge.misses,
+        "stale": stale,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--update-rate", type=float, default=0.01, help="fraction of requests that move a link")
+    parser.add_argument("--poll", type=int, default=100, help="requests between purge log polls")
+    parser.add_argument("--max-age", type=int, default=3600)
+    args = parser.parse_args()
+
+    client = urshortner.app.test_client()
+    codes = [
+        client.post("/api/urls", json={"originalUrl": "https://example.com/%d" % i}).json["shortCode"]
+        for i in range(args.links)
+    ]
+    print("%-8s %12s %12s %10s %8s" % ("max-age", "edge hits", "origin hits", "redirects", "stale"))
+    baseline = None
+    for max_age in (0, args.max_age):
+        result = run(client, codes, args, max_age, seed=1)
+        served = result["edge_hits"] + result["origin_hits"]
+        print("%-8d %12d %12d %10d %8d" % (
+            max_age, result["edge_hits"], result["origin_hits"], served, result["stale"]))
+        if baseline is None:
+            baseline = result["origin_hits"]
+        else:
+            print("origin redirect traffic down %.1f%%" % (100 * (1 - result["origin_hits"] / baseline)))
+
+
+if __name__ == "__main__":
+    main()
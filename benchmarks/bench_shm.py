@@ -0,0 +1,87 @@
+"""How quickly worker processes sharing an shm link table see a new code,
+how fast they read, and what the table costs each of them in memory.
+
+One process writes a probe code every few milliseconds; each reader
+process polls for it and records the delay (CLOCK_MONOTONIC is shared by
+all processes on Linux).
+
+    python benchmarks/bench_shm.py --links 200000 --readers 4
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shmstore import ShmStore  # noqa: E402
+
+
+def proportional_set_size():
+    # This process's fair share of resident memory, in MB (Linux only)
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def reader(path, links, probes, results):
+    store = ShmStore(path)
+    started = time.perf_counter()
+    reads = 0
+    while time.perf_counter() - started < 1.0:
+        store.get("k%d" % (reads % links))
+        reads += 1
+    delays = []
+    for i in range(probes):
+        while True:
+            details = store.get("probe%d" % i)
+            if details is not None:
+                break
+        delays.append(time.monotonic() - details["createdAt"])
+    results.put((delays, reads, proportional_set_size()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--links", type=int, default=200000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--probes", type=int, default=200)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-shm-"), "url_data.shm")
+    store = ShmStore(path)
+    with store.batch():
+        for i in range(args.links):
+            store.put("k%d" % i, {"originalUrl": "https://example.com/%d" % i, "createdAt": 0.0, "archived": False})
+
+    results = multiprocessing.Queue()
+    readers = [multiprocessing.Process(target=reader, args=(path, args.links, args.probes, results))
+               for _ in range(args.readers)]
+    for p in readers:
+        p.start()
+    time.sleep(1.5)
+    for i in range(args.probes):
+        store.put("probe%d" % i, {"originalUrl": "https://example.com/p%d" % i,
+                                   "createdAt": time.monotonic(), "archived": False})
+        time.sleep(0.005)
+    outcomes = [results.get() for _ in readers]
+    for p in readers:
+        p.join()
+
+    delays = sorted(d for delays, _, _ in outcomes for d in delays)
+    print("links                %d" % args.links)
+    print("readers              %d" % args.readers)
+    print("reads/s per reader   %.0f" % statistics.mean(reads for _, reads, _ in outcomes))
+    print("visible after p50    %.3f ms" % (delays[len(delays) // 2] * 1e3))
+    print("visible after p99    %.3f ms" % (delays[int(len(delays) * 0.99)] * 1e3))
+    print("Pss per reader       %.1f MB" % statistics.mean(pss for _, _, pss in outcomes))
+    print("table file on disk   %.1f MB" % (os.stat(path).st_blocks * 512 / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Time from opening the json backend to serving the first lookup, with a
+JSON snapshot against a binary (memory-mapped) one, plus peak RSS. Each
+measurement runs in a fresh interpreter (peak RSS is read from /proc, so
+Linux only).
+
+    python benchmarks/bench_startup.py --links 1000000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from snapshot import save_snapshot  # noqa: E402
+
+PROBE = """
+import sys, time
+sys.path.insert(0, %r)
+started = time.perf_counter()
+from storage import JsonStore
+store = JsonStore(%r, binary=%r)
+opened = time.perf_counter()
+assert store.get("k0000001") is not None
+first = time.perf_counter() - opened
+with open("/proc/self/status") as f:
+    peak = next(line.split()[1] for line in f if line.startswith("VmHWM:"))
+print(opened - started, first, peak)
+"""
+
+
+def links(count):
+    now = time.time()
+    for i in range(count):
+        yield "k%07d" % i, {
+            "originalUrl": "https://example.com/articles/%d/some-readable-slug" % i,
+            "createdAt": now - i,
+            "archived": False,
+        }
+
+
+def probe(path, binary):
+    # Fresh interpreter, so the page cache is the only thing carried over
+    output = subprocess.check_output(
+        [sys.executable, "-c", PROBE % (ROOT, path, binary)], cwd=os.path.dirname(path)
+    )
+    opened, first, rss_kb = output.split()
+    return float(opened), float(first), int(rss_kb) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--links", type=int, default=200000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench-startup-")
+    json_path = os.path.join(directory, "url_data.json")
+    snap_path = os.path.join(directory, "url_data.snap")
+    with open(json_path, "w") as f:
+        json.dump(dict(links(args.links)), f, separators=(",", ":"))
+    save_snapshot(snap_path, links(args.links))
+
+    print("%-8s %10s %12s %14s %10s" % ("format", "file MB", "open ms", "first get ms", "peak MB"))
+    for name, path, binary in (("json", json_path, False), ("binary", snap_path, True)):
+        opened, first, rss = probe(path, binary)
+        print("%-8s %10.1f %12.1f %14.2f %10.1f" % (
+            name, os.path.getsize(path) / 1e6, opened * 1e3, first * 1e3, rss))
+
+
+if __name__ == "__main__":
+    main()
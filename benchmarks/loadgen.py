@@ -0,0 +1,326 @@
+"""Load test with production-shaped traffic: Zipf-skewed redirects mixed
+with shortens and updates, 404 probes, and optional write bursts. Drives
+the app in-process (Flask test client, fresh data in a temp directory) or
+a running server over HTTP, and reports throughput, p50/p95/p99 latency
+and error rates per route.
+
+    python benchmarks/loadgen.py --duration 30 --concurrency 32 --zipf 1.1
+    python benchmarks/loadgen.py --url http://127.0.0.1:5000 --mix redirect=90,shorten=5,update=5
+    python benchmarks/loadgen.py --replay access.log --replay-speed 10
+
+--replay takes an access log in common/combined format. Short codes in it
+are mapped onto seeded links in order of first appearance (so the skew is
+kept), lines that got a 404 replay as probes, and with --replay-speed the
+original spacing is kept, sped up by that factor (0 sends as fast as
+possible).
+"""
+import argparse
+import bisect
+import datetime
+import http.client
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROUTES = ("redirect", "probe", "shorten", "update", "list")
+
+LOG_LINE = re.compile(r'\[([^\]]+)\] "(GET|HEAD|POST|PUT|DELETE) (\S+) [^"]*" (\d{3})')
+
+
+def parse_mix(spec):
+    # "redirect=95,shorten=3,update=2" -> (routes, cumulative weights)
+    weights = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        route, _, weight = part.partition("=")
+        if route not in ROUTES or route == "probe":
+            raise ValueError("Unknown route %r in mix (probes are set with --probe-rate)" % route)
+        weights[route] = float(weight)
+    routes = list(weights)
+    return routes, list(itertools.accumulate(weights[r] for r in routes))
+
+
+class Zipf:
+    # Index in [0, n) with P(rank k) proportional to 1 / k**skew. Ranks are
+    # shuffled over the indexes so the hottest links aren't the oldest.
+
+    def __init__(self, n, skew, rng):
+        self.cumulative = list(itertools.accumulate(1 / (k ** skew) for k in range(1, n + 1)))
+        self.order = list(range(n))
+        rng.shuffle(self.order)
+
+    def sample(self, rng):
+        rank = bisect.bisect_left(self.cumulative, rng.random() * self.cumulative[-1])
+        return self.order[min(rank, len(self.order) - 1)]
+
+
+class InProcess:
+    # The Flask app through its test client, one client per worker
+
+    def __init__(self):
+        import urshortner
+        self.app = urshortner.app
+
+    def connect(self):
+        client = self.app.test_client()
+
+        def send(method, path, body=None, content_type="application/json"):
+            response = client.open(path, method=method, data=body, content_type=content_type)
+            return response.status_code, response.get_data()
+        return send
+
+
+class Http:
+    # A running server, one keep-alive connection per worker
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+
+    def connect(self):
+        conn = [None]
+
+        def send(method, path, body=None, content_type="application/json"):
+            for attempt in range(2):
+                if conn[0] is None:
+                    conn[0] = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                try:
+                    headers = {"Content-Type": content_type} if body is not None else {}
+                    conn[0].request(method, path, body=body, headers=headers)
+                    response = conn[0].getresponse()
+                    return response.status, response.read()
+                except (OSError, http.client.HTTPException):
+                    # The server closed an idle connection; retry once on a new one
+                    conn[0].close()
+                    conn[0] = None
+                    if attempt:
+                        raise
+        return send
+
+
+def seed(transport, count, chunk=1000):
+    # Create `count` links through /api/urls/batch; returns their codes
+    send = transport.connect()
+    codes = []
+    for start in range(0, count, chunk):
+        lines = "".join(
+            json.dumps({"op": "create", "originalUrl": "https://example.com/seed/%d" % i}) + "\n"
+            for i in range(start, min(count, start + chunk))
+        )
+        status, body = send("POST", "/api/urls/batch", lines.encode(), "application/x-ndjson")
+        if status != 200:
+            raise SystemExit("Seeding failed with HTTP %d: %r" % (status, body[:200]))
+        codes.extend(json.loads(line)["shortCode"] for line in body.splitlines() if line)
+    return codes
+
+
+class Traffic:
+    # Synthetic requests: (route, method, path, body)
+
+    def __init__(self, codes, mix, burst_mix, zipf, probe_rate):
+        self.codes = codes
+        self.mix = mix
+        self.burst_mix = burst_mix
+        self.zipf = zipf
+        self.probe_rate = probe_rate
+        self.serial = itertools.count()
+
+    def next(self, rng, bursting):
+        routes, cumulative = self.burst_mix if bursting else self.mix
+        route = routes[bisect.bisect_left(cumulative, rng.random() * cumulative[-1])]
+        if route == "redirect":
+            if rng.random() < self.probe_rate:
+                return "probe", "GET", "/missing%d" % next(self.serial), None
+            return route, "GET", "/" + self.codes[self.zipf.sample(rng)], None
+        if route == "shorten":
+            body = {"originalUrl": "https://example.com/new/%d/%d" % (os.getpid(), next(self.serial))}
+            return route, "POST", "/api/urls", json.dumps(body).encode()
+        if route == "update":
+            body = {"shortCode": self.codes[self.zipf.sample(rng)], "archived": False}
+            return route, "PUT", "/api/urls", json.dumps(body).encode()
+        return route, "GET", "/api/urls?limit=100", None
+
+
+def read_log(path, codes, speed):
+    # (due offset in seconds or None, route, method, path, body) per log line
+    mapped = {}
+    first = None
+    serial = itertools.count()
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = LOG_LINE.search(line)
+            if match is None:
+                continue
+            stamp, method, target, status = match.groups()
+            due = None
+            if speed > 0:
+                when = datetime.datetime.strptime(stamp, "%d/%b/%Y:%H:%M:%S %z").timestamp()
+                first = when if first is None else first
+                due = (when - first) / speed
+            target_path = urlsplit(target).path
+            if target_path.startswith("/api/"):
+                if method == "POST" and target_path == "/api/urls":
+                    body = {"originalUrl": "https://example.com/replay/%d/%d" % (os.getpid(), next(serial))}
+                    yield due, "shorten", method, "/api/urls", json.dumps(body).encode()
+                elif method == "PUT" and target_path == "/api/urls":
+                    body = {"shortCode": codes[next(serial) % len(codes)], "archived": False}
+                    yield due, "update", method, "/api/urls", json.dumps(body).encode()
+                elif method in ("GET", "HEAD"):
+                    yield due, "list", method, target, None
+            elif target_path.count("/") == 1 and len(target_path) > 1 and method in ("GET", "HEAD"):
+                if status == "404":
+                    yield due, "probe", method, "/missing%d" % next(serial), None
+                else:
+                    code = mapped.setdefault(target_path, codes[len(mapped) % len(codes)])
+                    yield due, "redirect", method, "/" + code, None
+
+
+class Results:
+    # Latencies and outcomes per route, merged from every worker
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def merge(self, latencies, statuses, errors):
+        with self._lock:
+            for route, values in latencies.items():
+                self.latencies.setdefault(route, []).extend(values)
+            for key, count in statuses.items():
+                self.statuses[key] = self.statuses.get(key, 0) + count
+            for route, count in errors.items():
+                self.errors[route] = self.errors.get(route, 0) + count
+
+    def summary(self, elapsed):
+        report = {}
+        for route in sorted(set(self.latencies) | set(self.errors)):
+            # Requests that failed without a response have no latency
+            ordered = sorted(self.latencies.get(route, ())) or [0.0]
+            failed = self.errors.get(route, 0)
+            n = len(self.latencies.get(route, ())) + failed
+            statuses = {s: c for (r, s), c in self.statuses.items() if r == route}
+            server_errors = sum(c for s, c in statuses.items() if s >= 500) + failed
+            report[route] = {
+                "requests": n,
+                "rps": n / elapsed,
+                "p50_ms": ordered[len(ordered) // 2] * 1e3,
+                "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1e3,
+                "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e3,
+                "max_ms": ordered[-1] * 1e3,
+                "error_rate": server_errors / n,
+                "statuses": {str(s): c for s, c in sorted(statuses.items())},
+            }
+        return report
+
+
+def run(transport, next_request, concurrency, deadline, results):
+    # Closed loop: each worker sends its next request as soon as the last
+    # one returns. next_request(rng) returns None when there is no more work.
+    started = time.perf_counter()
+
+    def worker(n):
+        send = transport.connect()
+        rng = random.Random(n)
+        latencies, statuses, errors = {}, {}, {}
+        while deadline is None or time.perf_counter() < deadline:
+            item = next_request(rng)
+            if item is None:
+                break
+            due, route, method, path, body = item
+            if due is not None:
+                delay = started + due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            sent = time.perf_counter()
+            try:
+                status, _ = send(method, path, body)
+            except (OSError, http.client.HTTPException):
+                errors[route] = errors.get(route, 0) + 1
+                continue
+            latencies.setdefault(route, []).append(time.perf_counter() - sent)
+            statuses[route, status] = statuses.get((route, status), 0) + 1
+        results.merge(latencies, statuses, errors)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server (default: drive the app in-process)")
+    parser.add_argument("--links", type=int, default=10000, help="links to seed before the run")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run (synthetic traffic)")
+    parser.add_argument("--zipf", type=float, default=1.1, help="skew of redirects and updates over links")
+    parser.add_argument("--mix", default="redirect=95,shorten=3,update=2", help="relative weights per route")
+    parser.add_argument("--probe-rate", type=float, default=0.01, help="fraction of redirects to missing codes")
+    parser.add_argument("--burst-every", type=float, default=0, help="seconds between write bursts (0: none)")
+    parser.add_argument("--burst-for", type=float, default=1, help="length of each burst in seconds")
+    parser.add_argument("--burst-mix", default="redirect=50,shorten=30,update=20", help="mix during bursts")
+    parser.add_argument("--replay", help="access log to replay instead of synthetic traffic")
+    parser.add_argument("--replay-speed", type=float, default=0, help="speed-up over the log's timing (0: none)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the report as JSON here")
+    args = parser.parse_args()
+
+    if args.url:
+        transport = Http(args.url)
+    else:
+        os.chdir(tempfile.mkdtemp(prefix="loadgen-"))
+        transport = InProcess()
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    codes = seed(transport, args.links)
+    print("Seeded %d links in %.1fs" % (len(codes), time.perf_counter() - started))
+
+    if args.replay:
+        log = read_log(args.replay, codes, args.replay_speed)
+        lock = threading.Lock()
+
+        def next_request(_):
+            with lock:
+                return next(log, None)
+        deadline = None
+    else:
+        traffic = Traffic(codes, parse_mix(args.mix), parse_mix(args.burst_mix),
+                          Zipf(len(codes), args.zipf, rng), args.probe_rate)
+        begin = time.perf_counter()
+
+        def next_request(worker_rng):
+            offset = time.perf_counter() - begin
+            bursting = args.burst_every > 0 and offset % args.burst_every >= args.burst_every - args.burst_for
+            return (None,) + traffic.next(worker_rng, bursting)
+        deadline = begin + args.duration
+
+    results = Results()
+    elapsed = run(transport, next_request, args.concurrency, deadline, results)
+    report = results.summary(elapsed)
+    total = sum(r["requests"] for r in report.values())
+    print("%d requests in %.1fs (%.0f/s), concurrency %d" % (total, elapsed, total / elapsed, args.concurrency))
+    print("%-10s %9s %9s %9s %9s %9s %9s %8s  %s" % (
+        "route", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms", "errors", "statuses"))
+    for route, r in report.items():
+        print("%-10s %9d %9.0f %9.2f %9.2f %9.2f %9.2f %7.2f%%  %s" % (
+            route, r["requests"], r["rps"], r["p50_ms"], r["p95_ms"], r["p99_ms"], r["max_ms"],
+            r["error_rate"] * 100, " ".join("%s:%d" % item for item in r["statuses"].items())))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "elapsed": elapsed, "routes": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Benchmark suite for the shortener's hot paths, driven through Flask's
+test client (no network).
+
+For each backend and store size it seeds synthetic links, then reports
+ops/sec and latency percentiles for redirects, every /api/urls method,
+generate_short_code and snapshot writes. It also runs multi-threaded
+contention scenarios. Each (backend, size) runs in a fresh interpreter,
+because urshortner reads its configuration at import.
+
+    python benchmarks/suite.py --sizes 10k,1m --output results.json
+    python benchmarks/suite.py --sizes 10k --compare results.json
+
+With --compare, any operation whose ops/sec dropped by more than
+--threshold against the baseline is reported as a regression and the
+exit status is 1.
+
+Seeding 10M links takes several minutes and needs several GB of RAM for
+the json backend; sqlite, shm and binary snapshots need much less.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SIZES = {"k": 1000, "m": 1000000}
+
+# Backend name -> environment for urshortner
+BACKENDS = {
+    "json": {"URL_STORAGE": "json", "URL_DATA_FILE": "url_data.json"},
+    "binary": {"URL_STORAGE": "json", "URL_SNAPSHOT": "binary", "URL_DATA_FILE": "url_data.snap"},
+    "compact": {"URL_STORAGE": "json", "URL_COMPACT_STORE": "1", "URL_DATA_FILE": "url_data.json"},
+    "sqlite": {"URL_STORAGE": "sqlite", "URL_DATA_FILE": "url_data.db"},
+    "shm": {"URL_STORAGE": "shm", "URL_DATA_FILE": "url_data.shm"},
+}
+
+# Operations run single-threaded, and the ones also run under contention
+OPERATIONS = ("redirect", "redirect_miss", "create", "create_existing", "list", "update",
+              "delete", "generate_short_code", "snapshot")
+CONTENDED = ("redirect", "create", "mixed")
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    if text[-1] in SIZES:
+        return int(float(text[:-1]) * SIZES[text[-1]])
+    return int(text)
+
+
+def seeded_code(i):
+    return "s%08d" % i
+
+
+def seeded_url(i):
+    return "https://example.com/seed/%d" % i
+
+
+def links(size):
+    now = time.time()
+    for i in range(size):
+        yield seeded_code(i), {"originalUrl": seeded_url(i), "createdAt": now - i, "archived": False}
+
+
+def seed(backend, size):
+    # Write `size` links in the backend's own format, in the current directory
+    env = BACKENDS[backend]
+    path = env["URL_DATA_FILE"]
+    if env.get("URL_SNAPSHOT") == "binary":
+        from snapshot import save_snapshot
+        save_snapshot(path, links(size))
+    elif env["URL_STORAGE"] == "json":
+        # Streamed, so seeding doesn't hold a second copy of the dataset
+        with open(path, "w") as f:
+            f.write("{")
+            for i, (code, details) in enumerate(links(size)):
+                f.write("%s%s:%s" % ("," if i else "", json.dumps(code), json.dumps(details)))
+            f.write("}")
+    else:
+        from storage import open_store
+        store = open_store(env["URL_STORAGE"], path)
+        with store.batch():
+            for code, details in links(size):
+                store.put(code, details)
+        store.close()
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(operation, make_op, count, threads=1):
+    # Run count ops split over `threads` threads; make_op(n) returns the
+    # callable one thread uses, taking the op number.
+    per_thread = max(1, count // threads)
+    latencies = [[] for _ in range(threads)]
+    start_gate = threading.Barrier(threads + 1)
+
+    def worker(n):
+        op = make_op(n)
+        timings = latencies[n]
+        start_gate.wait()
+        for i in range(per_thread):
+            started = time.perf_counter()
+            op(i)
+            timings.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    start_gate.wait()
+    started = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    ordered = sorted(t for timings in latencies for t in timings)
+    return {
+        "operation": operation,
+        "threads": threads,
+        "ops": len(ordered),
+        "ops_per_sec": len(ordered) / elapsed,
+        "p50_ms": percentile(ordered, 0.50) * 1e3,
+        "p90_ms": percentile(ordered, 0.90) * 1e3,
+        "p99_ms": percentile(ordered, 0.99) * 1e3,
+        "max_ms": ordered[-1] * 1e3,
+    }
+
+
+def run_worker(backend, size, count, thread_counts):
+    os.chdir(tempfile.mkdtemp(prefix="bench-suite-"))
+    seeding = time.perf_counter()
+    seed(backend, size)
+    seeded = time.perf_counter() - seeding
+    os.environ.update(BACKENDS[backend])
+    os.environ.setdefault("URL_RATE_LIMIT", "0")
+    opening = time.perf_counter()
+    import urshortner
+    opened = time.perf_counter() - opening
+    app = urshortner.app
+    created = []
+
+    def ops(operation, n):
+        client = app.test_client()
+        rng = random.Random(n)
+        tag = "%s-%d-%d" % (operation, n, time.monotonic_ns())
+        if operation == "redirect":
+            return lambda i: client.get("/" + seeded_code(rng.randrange(size)))
+        if operation == "redirect_miss":
+            return lambda i: client.get("/missing%d" % i)
+        if operation == "create":
+            def create(i):
+                body = client.post("/api/urls", json={"originalUrl": "https://example.com/%s/%d" % (tag, i)}).json
+                created.append(body["shortCode"])
+            return create
+        if operation == "create_existing":
+            return lambda i: client.post("/api/urls", json={"originalUrl": seeded_url(rng.randrange(size))})
+        if operation == "list":
+            return lambda i: client.get("/api/urls?limit=100&cursor=%s" % urshortner.encode_cursor(
+                seeded_code(rng.randrange(size))))
+        if operation == "update":
+            return lambda i: client.put("/api/urls", json={
+                "shortCode": seeded_code(rng.randrange(size)), "archived": i % 2 == 0})
+        if operation == "delete":
+            return lambda i: client.delete("/api/urls", json={"shortCode": created.pop()})
+        if operation == "generate_short_code":
+            return lambda i: urshortner.generate_short_code()
+        if operation == "snapshot":
+            store = urshortner.store
+            if store.journal.binary:
+                return lambda i: store.journal.compact(store._copy_sorted, store._rebase)
+            return lambda i: store.journal.compact(store._copy)
+        if operation == "mixed":
+            redirect, create = ops("redirect", n), ops("create", n)
+            return lambda i: create(i) if i % 10 == 0 else redirect(i)
+        raise ValueError(operation)
+
+    results = []
+    for operation in OPERATIONS:
+        if operation == "snapshot" and not hasattr(urshortner.store, "journal"):
+            continue
+        if operation == "delete":
+            n = min(count, len(created))
+        elif operation == "snapshot":
+            n = 3
+        else:
+            n = count
+        results.append(measure(operation, lambda t: ops(operation, t), n))
+    for threads in thread_counts:
+        if threads > 1:
+            for operation in CONTENDED:
+                results.append(measure(operation, lambda t: ops(operation, t), count, threads))
+    for result in results:
+        result.update(backend=backend, size=size)
+    return {"backend": backend, "size": size, "seed_seconds": seeded, "open_seconds": opened,
+            "results": results}
+
+
+def key(result):
+    return "%s/%d/%s/%dt" % (result["backend"], result["size"], result["operation"], result["threads"])
+
+
+def compare(results, baseline, threshold):
+    # Print ops/sec against the baseline; returns the regressed keys
+    old = {key(r): r for r in baseline["results"]}
+    regressions = []
+    print("\n%-40s %12s %12s %8s" % ("vs baseline", "old ops/s", "new ops/s", "change"))
+    for result in results:
+        before = old.get(key(result))
+        if before is None:
+            continue
+        change = result["ops_per_sec"] / before["ops_per_sec"] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(key(result))
+            flag = "  REGRESSION"
+        print("%-40s %12.0f %12.0f %+7.1f%%%s" % (
+            key(result), before["ops_per_sec"], result["ops_per_sec"], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10k", help="store sizes to seed, e.g. 10k,1m,10m")
+    parser.add_argument("--backends", default="json", help=",".join(BACKENDS))
+    parser.add_argument("--ops", type=int, default=2000, help="operations per measurement")
+    parser.add_argument("--threads", default="1,8", help="thread counts for contention scenarios")
+    parser.add_argument("--output", help="write results as JSON here")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="ops/sec drop flagged as a regression")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    thread_counts = [int(t) for t in args.threads.split(",")]
+
+    if args.worker:
+        # One (backend, size) pair per interpreter; results go to stdout
+        backend, size = args.backends, parse_size(args.sizes)
+        json.dump(run_worker(backend, size, args.ops, thread_counts), sys.stdout)
+        return
+
+    runs = []
+    for backend in args.backends.split(","):
+        if backend not in BACKENDS:
+            parser.error("Unknown backend %r" % backend)
+        for size in args.sizes.split(","):
+            output = subprocess.check_output([
+                sys.executable, os.path.abspath(__file__), "--worker", "--backends", backend,
+                "--sizes", size, "--ops", str(args.ops), "--threads", args.threads,
+            ])
+            run = json.loads(output)
+            runs.append(run)
+            print("\n%s, %d links (seeded in %.1fs, opened in %.2fs)" % (
+                backend, run["size"], run["seed_seconds"], run["open_seconds"]))
+            print("%-20s %7s %10s %9s %9s %9s %9s" % (
+                "operation", "threads", "ops/s", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+            for r in run["results"]:
+                print("%-20s %7d %10.0f %9.3f %9.3f %9.3f %9.3f" % (
+                    r["operation"], r["threads"], r["ops_per_sec"], r["p50_ms"], r["p90_ms"],
+                    r["p99_ms"], r["max_ms"]))
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "ops": args.ops,
+        },
+        "runs": [{k: v for k, v in run.items() if k != "results"} for run in runs],
+        "results": [r for run in runs for r in run["results"]],
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report["results"], baseline, args.threshold)
+        if regressions:
+            print("\n%d regression(s) beyond %.0f%%" % (len(regressions), args.threshold * 100))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""Streaming bulk import and export of links as CSV or NDJSON.
+
+    python bulkio.py import links.csv --checkpoint links.ckpt --rejects rejects.ndjson
+    python bulkio.py export links.ndjson
+
+Uses the same URL_* settings as the app (backend, data file, code
+allocator). With the json backend stop the server while importing, since
+one process owns the journal; sqlite and shm stores can be imported into
+while the app is serving. Expiry of imported links is scheduled when the
+app next starts.
+
+Input rows have originalUrl (or url) and optionally shortCode, createdAt,
+archived, expiresAt, redirectStatus and maxAge; CSV needs a header row. A
+row with a shortCode (letters and digits, up to 64) keeps it. A row
+without one gets the code already serving its URL, or a new one from the
+allocator.
+
+Rows are validated in a process pool and written in batches. After each
+batch the checkpoint file records how many input rows are done, so an
+interrupted import rerun with the same --checkpoint carries on from there.
+Rows replayed from a batch that was written but not checkpointed come up
+as duplicates.
+
+Memory use is constant in the input size. Both sides use "-" for stdin or
+stdout.
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from batch import chunked
+from linkpolicy import is_valid_code, parse_policy
+from urlindex import is_valid_url, url_key
+
+
+FIELDS = ("shortCode", "originalUrl", "createdAt", "archived", "expiresAt", "redirectStatus", "maxAge")
+
+# Rows per task sent to a validation worker, and per write to the store
+CHUNK = 2000
+
+TRUE = ("1", "true", "yes", "y", "t")
+
+_header = None
+
+
+def set_header(header):
+    # Pool initializer: the CSV header, None for NDJSON
+    global _header
+    _header = header
+
+
+def parse_row(raw):
+    # {field: value} from a list of CSV cells or an NDJSON line
+    if _header is None:
+        row = json.loads(raw)
+        if not isinstance(row, dict):
+            raise ValueError("row must be an object")
+        return row
+    return {name: value for name, value in zip(_header, raw) if value != ""}
+
+
+def to_float(row, field):
+    value = row.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError("%s must be a number" % field)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("%s must be a number" % field)
+    if not math.isfinite(value):
+        raise ValueError("%s must be a number" % field)
+    return value
+
+
+def validate(raw, now):
+    # (details with an optional shortCode, None) or (None, reason)
+    try:
+        row = parse_row(raw)
+        url = row.get("originalUrl", row.get("url"))
+        if not isinstance(url, str) or not is_valid_url(url):
+            return None, "invalid URL"
+        created_at = to_float(row, "createdAt")
+        expires_at = to_float(row, "expiresAt")
+        policy = {}
+        for field in ("redirectStatus", "maxAge"):
+            value = to_float(row, field)
+            if value is not None:
+                # CSV cells arrive as text; parse_policy() wants whole numbers
+                policy[field] = int(value) if value.is_integer() else value
+    except ValueError as e:
+        return None, str(e)
+    policy, error = parse_policy(policy)
+    if error:
+        return None, error
+    archived = row.get("archived", False)
+    if isinstance(archived, str):
+        archived = archived.strip().lower() in TRUE
+    record = {
+        "originalUrl": url,
+        "createdAt": created_at if created_at is not None else now,
+        "archived": bool(archived),
+    }
+    if expires_at is not None:
+        record["expiresAt"] = expires_at
+    record.update(policy)
+    short_code = row.get("shortCode")
+    if short_code is not None:
+        if not is_valid_code(short_code):
+            return None, "invalid shortCode"
+        record["shortCode"] = short_code
+    return record, None
+
+
+def validate_chunk(chunk):
+    now = time.time()
+    return [validate(raw, now) for raw in chunk]
+
+
+def open_text(path, mode):
+    if path == "-":
+        return sys.stdin if mode == "r" else sys.stdout
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def read_checkpoint(path, source):
+    if path is None or not os.path.exists(path):
+        return {"input": source, "rows": 0, "imported": 0, "duplicates": 0, "rejected": 0}
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint["input"] != source:
+        raise SystemExit("%s belongs to an import of %s" % (path, checkpoint["input"]))
+    return checkpoint
+
+
+def write_checkpoint(path, checkpoint):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Importer:
+    # Writes validated records into the app's store, a batch at a time.
+    # Each batch runs inside store.batch(), which with sqlite and shm holds
+    # the writer lock across processes, and the json backend is imported
+    # with the server stopped, so nobody else creates links meanwhile:
+    # unlike the app, rows need no url_lock(). Duplicates within a batch
+    # are caught against the rows still pending in it.
+
+    def __init__(self, app, counts):
+        self.app = app
+        self.store = app.store
+        self.counts = counts
+        self.pending = {}
+        self.pending_urls = set()
+
+    def add(self, record):
+        # Returns a reason if the row is rejected
+        short_code = record.pop("shortCode", None)
+        url = record["originalUrl"]
+        key = url_key(url) if not record["archived"] else None
+        if short_code is not None:
+            existing = self.pending.get(short_code) or self.store.get(short_code)
+            if existing is not None:
+                if existing["originalUrl"] != url:
+                    return "shortCode already serves another URL"
+                self.counts["duplicates"] += 1
+                return None
+        else:
+            if key is not None and (key in self.pending_urls or self.store.find_by_url(url) is not None):
+                self.counts["duplicates"] += 1
+                return None
+            short_code = self.app.generate_short_code()
+        self.pending[short_code] = record
+        if key is not None:
+            self.pending_urls.add(key)
+        self.counts["imported"] += 1
+        return None
+
+    def flush(self):
+        items = list(self.pending.items())
+        while True:
+            try:
+                self.store.put_many(items)
+                break
+            except self.app.JournalFull:
+                # The journal writer is behind; let it catch up
+                time.sleep(0.05)
+        self.pending.clear()
+        self.pending_urls.clear()
+
+
+def run_import(args):
+    source = os.path.abspath(args.input) if args.input != "-" else "-"
+    fmt = args.format or ("csv" if args.input.endswith(".csv") else "ndjson")
+    checkpoint = read_checkpoint(args.checkpoint, source)
+    f = open_text(args.input, "r")
+    header = None
+    if fmt == "csv":
+        rows = csv.reader(f)
+        header = next(rows, None) or []
+        if "originalUrl" not in header and "url" not in header:
+            raise SystemExit("%s has no originalUrl (or url) column" % args.input)
+    else:
+        rows = (line for line in f if line.strip())
+    rows = itertools.islice(rows, checkpoint["rows"], None)
+
+    # Fork the validators before the app starts its threads and opens the store
+    pool = Pool(args.workers, initializer=set_header, initargs=(header,))
+    import urshortner
+    importer = Importer(urshortner, checkpoint)
+    rejects = open(args.rejects, "a", encoding="utf-8") if args.rejects else None
+
+    started = last_report = time.perf_counter()
+    done_before = checkpoint["rows"]
+    validated = pool.imap(validate_chunk, chunked(rows, CHUNK))
+    try:
+        for group in chunked(validated, max(1, args.batch // CHUNK)):
+            with importer.store.batch():
+                for results in group:
+                    for record, error in results:
+                        if error is None:
+                            error = importer.add(record)
+                        if error is not None:
+                            checkpoint["rejected"] += 1
+                            if rejects is not None:
+                                rejects.write(json.dumps({"row": checkpoint["rows"] + 1, "error": error}) + "\n")
+                        checkpoint["rows"] += 1
+                    importer.flush()
+            if rejects is not None:
+                rejects.flush()
+            if args.checkpoint:
+                write_checkpoint(args.checkpoint, checkpoint)
+            now = time.perf_counter()
+            if now - last_report >= args.progress:
+                last_report = now
+                report(checkpoint, (checkpoint["rows"] - done_before) / (now - started))
+    except urshortner.StoreFull as e:
+        raise SystemExit("Store is full after %d rows: %s" % (checkpoint["rows"], e))
+    finally:
+        pool.terminate()
+    elapsed = time.perf_counter() - started
+    report(checkpoint, (checkpoint["rows"] - done_before) / elapsed if elapsed else 0)
+    sys.stderr.write("\n")
+
+
+def report(checkpoint, rate):
+    sys.stderr.write("\r%(rows)d rows: %(imported)d imported, %(duplicates)d duplicates, %(rejected)d rejected" % checkpoint
+                     + ", %.0f rows/s   " % rate)
+    sys.stderr.flush()
+
+
+def run_export(args):
+    import urshortner
+    fmt = args.format or ("csv" if args.output.endswith(".csv") else "ndjson")
+    out = open_text(args.output, "w")
+    started = time.perf_counter()
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(FIELDS)
+        for short_code, details in urshortner.store.scan():
+            writer.writerow([
+                short_code, details["originalUrl"], details.get("createdAt", ""),
+                "true" if details.get("archived", False) else "false", details.get("expiresAt", ""),
+                details.get("redirectStatus", ""), details.get("maxAge", ""),
+            ])
+            count += 1
+    else:
+        for short_code, details in urshortner.store.scan():
+            out.write(json.dumps(dict(details, shortCode=short_code)) + "\n")
+            count += 1
+    out.flush()
+    sys.stderr.write("Exported %d links in %.1fs\n" % (count, time.perf_counter() - started))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    importing = commands.add_parser("import", help="add links from a file")
+    importing.add_argument("input")
+    importing.add_argument("--checkpoint", help="progress file for resuming an interrupted import")
+    importing.add_argument("--rejects", help="append rejected rows (row number and reason) here")
+    importing.add_argument("--workers", type=int, default=os.cpu_count(), help="validation processes")
+    importing.add_argument("--batch", type=int, default=20000, help="rows written per store batch")
+    importing.add_argument("--progress", type=float, default=2, help="seconds between progress lines")
+    exporting = commands.add_parser("export", help="write every link to a file")
+    exporting.add_argument("output")
+    for command in (importing, exporting):
+        command.add_argument("--format", choices=("csv", "ndjson"), help="default: from the file extension")
+    args = parser.parse_args()
+    if args.command == "import":
+        run_import(args)
+    else:
+        run_export(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import sqlite3
+import threading
+import time
+
+from hll import HyperLogLog
+
+
+class RingBuffer:
+    # Fixed-size single-producer/single-consumer ring. Only the owning
+    # thread moves `head` and only the aggregator moves `tail`, so neither
+    # side takes a lock. A full ring drops the new item and counts it.
+
+    def __init__(self, size):
+        self.size = size
+        self.slots = [None] * size
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        self.owner = threading.current_thread()
+        # Set by the owner once it has moved on to a bigger ring
+        self.retired = False
+
+    def push(self, item):
+        head = self.head
+        if head - self.tail >= self.size:
+            self.dropped += 1
+            return False
+        self.slots[head % self.size] = item
+        self.head = head + 1
+        return True
+
+    def drain(self):
+        head, tail = self.head, self.tail
+        items = [self.slots[i % self.size] for i in range(tail, head)]
+        self.tail = head
+        return items
+
+
+class ClickStats:
+    # Click counting kept off the redirect path: record() only appends to
+    # the calling thread's ring buffer. Rings start small, since servers
+    # often run a thread per request; a thread whose ring fills up moves to
+    # one twice the size, up to `buffer_size` slots, and clicks past a full
+    # ring of that size are dropped. A background aggregator empties the
+    # rings every `interval` seconds, rolls the hits up into per-code totals
+    # and per-minute buckets, and writes them to SQLite in one transaction.
+    #
+    # Unique visitors are estimated with one HyperLogLog sketch per code and
+    # `uniques_window` (a day by default). Flushing merges the new sketch
+    # into the stored one, so several workers can share the same file.
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS click_minutes ("
+        " code TEXT NOT NULL, minute INTEGER NOT NULL, count INTEGER NOT NULL,"
+        " PRIMARY KEY (code, minute)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS click_totals ("
+        " code TEXT PRIMARY KEY, total INTEGER NOT NULL, last_click REAL NOT NULL"
+        ") WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS click_uniques ("
+        " code TEXT NOT NULL, window INTEGER NOT NULL, sketch BLOB NOT NULL,"
+        " PRIMARY KEY (code, window)) WITHOUT ROWID",
+    )
+    ADD_MINUTE = (
+        "INSERT INTO click_minutes (code, minute, count) VALUES (?, ?, ?)"
+        " ON CONFLICT (code, minute) DO UPDATE SET count = count + excluded.count"
+    )
+    ADD_TOTAL = (
+        "INSERT INTO click_totals (code, total, last_click) VALUES (?, ?, ?)"
+        " ON CONFLICT (code) DO UPDATE SET total = total + excluded.total,"
+        " last_click = MAX(last_click, excluded.last_click)"
+    )
+    SELECT_SKETCH = "SELECT sketch FROM click_uniques WHERE code = ? AND window = ?"
+    PUT_SKETCH = "INSERT OR REPLACE INTO click_uniques (code, window, sketch) VALUES (?, ?, ?)"
+    SELECT_SKETCHES = (
+        "SELECT sketch FROM click_uniques"
+        " WHERE code = ? AND window >= ? AND window <= ?"
+    )
+    SELECT_TOTAL = "SELECT total, last_click FROM click_totals WHERE code = ?"
+    SELECT_MINUTES = (
+        "SELECT minute, count FROM click_minutes"
+        " WHERE code = ? AND minute >= ? AND minute <= ? ORDER BY minute"
+    )
+    # Slots in a thread's first ring
+    INITIAL_RING = 64
+
+    def __init__(self, path, buffer_size=65536, interval=5.0, uniques_window=86400, precision=12):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.uniques_window = uniques_window
+        self.precision = precision
+        self._local = threading.local()
+        self._rings = []
+        self._rings_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._retired_dropped = 0
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self._conn.execute(statement)
+        self._db_lock = threading.Lock()
+        # Called with each drained batch of (code, time, visitor) hits
+        self.listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _new_ring(self, size):
+        ring = self._local.ring = RingBuffer(size)
+        with self._rings_lock:
+            self._rings.append(ring)
+        return ring
+
+    def record(self, short_code, when=None, visitor=None):
+        # visitor is any string identifying the client (IP + user agent);
+        # it is only hashed later, by the aggregator
+        ring = getattr(self._local, "ring", None)
+        if ring is None:
+            ring = self._new_ring(min(self.INITIAL_RING, self.buffer_size))
+        elif ring.head - ring.tail >= ring.size and ring.size < self.buffer_size:
+            # The old ring stays registered until the aggregator empties it
+            ring.retired = True
+            ring = self._new_ring(min(ring.size * 2, self.buffer_size))
+        ring.push((short_code, when if when is not None else time.time(), visitor))
+
+    @property
+    def dropped(self):
+        return self._retired_dropped + sum(ring.dropped for ring in list(self._rings))
+
+    def drain(self):
+        hits = []
+        with self._rings_lock:
+            rings = list(self._rings)
+        for ring in rings:
+            hits.extend(ring.drain())
+            if (ring.retired or not ring.owner.is_alive()) and ring.head == ring.tail:
+                with self._rings_lock:
+                    self._rings.remove(ring)
+                    self._retired_dropped += ring.dropped
+        return hits
+
+    def flush(self):
+        with self._flush_lock:
+            hits = self.drain()
+            # Listeners also hear about quiet ticks, so windows still slide
+            for listener in self.listeners:
+                listener(hits)
+            if not hits:
+                return 0
+            minutes = {}
+            totals = {}
+            sketches = {}
+            for short_code, when, visitor in hits:
+                key = (short_code, int(when // 60) * 60)
+                minutes[key] = minutes.get(key, 0) + 1
+                total, last = totals.get(short_code, (0, 0.0))
+                totals[short_code] = (total + 1, max(last, when))
+                if visitor is not None:
+                    key = (short_code, self._window(when))
+                    sketch = sketches.get(key)
+                    if sketch is None:
+                        sketch = sketches[key] = HyperLogLog(self.precision)
+                    sketch.add(visitor)
+            self.persist(minutes, totals, sketches)
+            return len(hits)
+
+    def _window(self, when):
+        return int(when // self.uniques_window) * self.uniques_window
+
+    def persist(self, minutes, totals, sketches=None):
+        with self._db_lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(self.ADD_MINUTE, [(c, m, n) for (c, m), n in minutes.items()])
+                conn.executemany(self.ADD_TOTAL, [(c, n, t) for c, (n, t) in totals.items()])
+                for key, sketch in (sketches or {}).items():
+                    row = conn.execute(self.SELECT_SKETCH, key).fetchone()
+                    if row is not None:
+                        sketch.merge(HyperLogLog.from_bytes(row[0], self.precision))
+                    conn.execute(self.PUT_SKETCH, key + (sketch.to_bytes(),))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def history(self, short_code, start, end):
+        with self._db_lock:
+            row = self._conn.execute(self.SELECT_TOTAL, (short_code,)).fetchone()
+            minutes = self._conn.execute(
+                self.SELECT_MINUTES, (short_code, int(start // 60) * 60, int(end))
+            ).fetchall()
+        return {
+            "shortCode": short_code,
+            "total": row[0] if row else 0,
+            "lastClickAt": row[1] if row else None,
+            "minutes": [{"minute": m, "count": n} for m, n in minutes],
+        }
+
+    def uniques(self, short_code, start, end):
+        # Estimated distinct visitors in the windows overlapping [start, end]
+        with self._db_lock:
+            rows = self._conn.execute(
+                self.SELECT_SKETCHES, (short_code, self._window(start), self._window(end))
+            ).fetchall()
+        sketch = HyperLogLog(self.precision)
+        for row in rows:
+            sketch.merge(HyperLogLog.from_bytes(row[0], self.precision))
+        return {
+            "shortCode": short_code,
+            "from": self._window(start),
+            "to": self._window(end) + self.uniques_window,
+            "uniques": round(sketch.estimate()),
+            "relativeError": sketch.relative_error,
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.interval):
+                self.flush()
+
+        self._thread = threading.Thread(target=run, name="click-aggregator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
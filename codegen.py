@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import string
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows
+    fcntl = None
+
+
+ALPHABET = string.ascii_letters + string.digits
+BASE = len(ALPHABET)
+MIN_LENGTH = 6
+
+
+def encode(number, length):
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, BASE)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode(code):
+    number = 0
+    for char in code:
+        number = number * BASE + ALPHABET.index(char)
+    return number
+
+
+class FeistelPermutation:
+    # A keyed bijection on range(size). A balanced Feistel network works on
+    # the smallest even number of bits covering size; values that land
+    # outside the range are fed through again (cycle walking), which takes
+    # fewer than two passes on average.
+
+    def __init__(self, key, size, rounds=4):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        bits += bits % 2
+        self.half = bits // 2
+        self.mask = (1 << self.half) - 1
+        self.keys = [key + bytes([r]) for r in range(rounds)]
+
+    def _round(self, key, value):
+        digest = hashlib.blake2b(value.to_bytes(8, "little"), digest_size=8, key=key).digest()
+        return int.from_bytes(digest, "little") & self.mask
+
+    def _forward(self, value):
+        left, right = value >> self.half, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(key, right)
+        return (left << self.half) | right
+
+    def _backward(self, value):
+        left, right = value >> self.half, value & self.mask
+        for key in reversed(self.keys):
+            left, right = right ^ self._round(key, left), left
+        return (left << self.half) | right
+
+    def permute(self, value):
+        value = self._forward(value)
+        while value >= self.size:
+            value = self._forward(value)
+        return value
+
+    def invert(self, value):
+        value = self._backward(value)
+        while value >= self.size:
+            value = self._backward(value)
+        return value
+
+
+class CodeAllocator:
+    # Hands out short codes by pushing a monotonic counter through a
+    # Feistel permutation, so codes look random but never collide and
+    # each allocation is O(1). Counters 0..62^6-1 give 6-character codes,
+    # the next 62^7 give 7-character codes, and so on.
+    #
+    # Processes reserve counters in blocks from a small state file, taking
+    # an flock only once per block. With `nodes` > 1, node i only uses
+    # every nodes-th block, so machines that don't share the state file
+    # still never overlap.
+
+    def __init__(self, path, block_size=1000, node=0, nodes=1, min_length=MIN_LENGTH):
+        self.path = path
+        self.block_size = block_size
+        self.node = node
+        self.nodes = nodes
+        self.min_length = min_length
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._key = None
+        self._tiers = {}
+
+    def _locked_state(self, update):
+        # Read the state file, let update() change it, and write it back
+        # while holding an exclusive lock on it.
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = b""
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                raw += chunk
+            state = json.loads(raw) if raw.strip() else {}
+            if "key" not in state:
+                state["key"] = os.urandom(16).hex()
+                state["nextBlock"] = 0
+            result = update(state)
+            data = json.dumps(state).encode("utf-8")
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, data)
+            os.fsync(fd)
+            return state, result
+        finally:
+            os.close(fd)
+
+    def _reserve(self):
+        def take(state):
+            block = state["nextBlock"]
+            state["nextBlock"] = block + 1
+            return block
+
+        state, block = self._locked_state(take)
+        if self._key is None:
+            self._key = bytes.fromhex(state["key"])
+        start = (block * self.nodes + self.node) * self.block_size
+        self._next, self._end = start, start + self.block_size
+
+    def _tier(self, length):
+        tier = self._tiers.get(length)
+        if tier is None:
+            key = hashlib.blake2b(self._key + bytes([length]), digest_size=16).digest()
+            tier = self._tiers[length] = FeistelPermutation(key, BASE ** length)
+        return tier
+
+    def code_for(self, counter):
+        length = self.min_length
+        while counter >= BASE ** length:
+            counter -= BASE ** length
+            length += 1
+        return encode(self._tier(length).permute(counter), length)
+
+    def counter_for(self, code):
+        # Inverse of code_for(); handy for auditing which block a code came from
+        if self._key is None:
+            state, _ = self._locked_state(lambda state: None)
+            self._key = bytes.fromhex(state["key"])
+        offset = sum(BASE ** length for length in range(self.min_length, len(code)))
+        return offset + self._tier(len(code)).invert(decode(code))
+
+    def next_code(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._reserve()
+            counter = self._next
+            self._next += 1
+        return self.code_for(counter)
@@ -0,0 +1,271 @@
+import math
+import threading
+from array import array
+from collections.abc import MutableMapping
+
+from codegen import ALPHABET
+
+
+CHAR_VALUES = {char: i + 1 for i, char in enumerate(ALPHABET)}
+# Bijective base 62 fits codes of up to 10 characters in a signed 64-bit int
+MAX_PACKED_LENGTH = 10
+
+EMPTY = 0
+TOMBSTONE = -1
+GOLDEN = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+
+def pack_code(code):
+    # Bijective base-62 numbering, so "a" and "aa" stay distinct. Returns
+    # None for codes that can't be packed (too long or odd characters).
+    if not code or len(code) > MAX_PACKED_LENGTH:
+        return None
+    number = 0
+    for char in code:
+        value = CHAR_VALUES.get(char)
+        if value is None:
+            return None
+        number = number * 62 + value
+    return number
+
+
+def unpack_code(number):
+    chars = []
+    while number:
+        number, digit = divmod(number - 1, 62)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+class CompactTable(MutableMapping):
+    # The link store laid out in columns instead of a dict per link:
+    #
+    #   codes      array('q')  short code packed into an integer
+    #   arena      bytearray   every originalUrl back to back, as UTF-8
+    #   offsets    array('Q')  + lengths array('I'): where each URL lives
+    #   created    array('d')  createdAt
+    #   expires    array('d')  expiresAt, NaN when unset
+    #   archived   bitset      one bit per row
+    #   live       bitset      rows in use; deleted rows are reused
+    #   slots      array('q')  open-addressing index, row + 1 per slot
+    #
+    # That is roughly 50 bytes per link plus the URL itself. Fields other
+    # than those above, and codes that can't be packed, live in plain dicts
+    # on the side. Reads and writes take the table lock, so it can be shared
+    # between threads like a dict.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes = array("q")
+        self._arena = bytearray()
+        self._offsets = array("Q")
+        self._lengths = array("I")
+        self._created = array("d")
+        self._expires = array("d")
+        self._archived = bytearray()
+        self._live = bytearray()
+        self._free = []
+        self._garbage = 0
+        self._count = 0
+        self._slots = array("q", bytes(8 * 16))
+        self._shift = 64 - 4
+        self._used_slots = 0
+        self._extra = {}
+        self._odd = {}
+
+    # -- index
+
+    def _find(self, packed):
+        # (slot position, row) of packed, or (first reusable position, None).
+        # Fibonacci hashing picks the home slot, then linear probing.
+        slots = self._slots
+        mask = len(slots) - 1
+        position = ((packed * GOLDEN) & MASK64) >> self._shift
+        free = None
+        while True:
+            entry = slots[position]
+            if entry == EMPTY:
+                return (free if free is not None else position), None
+            if entry == TOMBSTONE:
+                if free is None:
+                    free = position
+            elif self._codes[entry - 1] == packed:
+                return position, entry - 1
+            position = (position + 1) & mask
+
+    def _resize(self):
+        # Rebuild at most 35% full, which also clears out tombstones
+        bits = 4
+        while (1 << bits) * 0.35 < self._count:
+            bits += 1
+        self._slots = array("q", bytes(8 << bits))
+        self._shift = 64 - bits
+        self._used_slots = 0
+        for row in range(len(self._codes)):
+            if self._get_bit(self._live, row):
+                position, _ = self._find(self._codes[row])
+                self._slots[position] = row + 1
+                self._used_slots += 1
+
+    # -- bits
+
+    @staticmethod
+    def _get_bit(bits, row):
+        return bool(bits[row >> 3] & (1 << (row & 7)))
+
+    @staticmethod
+    def _set_bit(bits, row, value):
+        if value:
+            bits[row >> 3] |= 1 << (row & 7)
+        else:
+            bits[row >> 3] &= ~(1 << (row & 7)) & 0xFF
+
+    # -- rows
+
+    def _store_url(self, row, url):
+        data = url.encode("utf-8")
+        if row < len(self._offsets):
+            self._garbage += self._lengths[row]
+            self._offsets[row] = len(self._arena)
+            self._lengths[row] = len(data)
+        else:
+            self._offsets.append(len(self._arena))
+            self._lengths.append(len(data))
+        self._arena += data
+        if self._garbage > 1 << 20 and self._garbage > len(self._arena) // 2:
+            self._compact_arena()
+
+    def _compact_arena(self):
+        arena = bytearray()
+        for row in range(len(self._codes)):
+            if self._get_bit(self._live, row):
+                start = self._offsets[row]
+                data = self._arena[start:start + self._lengths[row]]
+                self._offsets[row] = len(arena)
+                arena += data
+            else:
+                self._offsets[row] = 0
+                self._lengths[row] = 0
+        self._arena = arena
+        self._garbage = 0
+
+    def _read(self, row):
+        start = self._offsets[row]
+        details = {
+            "originalUrl": self._arena[start:start + self._lengths[row]].decode("utf-8"),
+            "createdAt": self._created[row],
+            "archived": self._get_bit(self._archived, row),
+        }
+        expires = self._expires[row]
+        if not math.isnan(expires):
+            details["expiresAt"] = expires
+        extra = self._extra.get(row)
+        if extra:
+            details.update(extra)
+        return details
+
+    def _write(self, row, packed, details):
+        if row == len(self._codes):
+            self._codes.append(packed)
+            self._created.append(0.0)
+            self._expires.append(math.nan)
+            if row >> 3 >= len(self._archived):
+                self._archived.append(0)
+                self._live.append(0)
+        else:
+            self._codes[row] = packed
+        self._store_url(row, details["originalUrl"])
+        self._created[row] = details.get("createdAt", 0.0)
+        expires = details.get("expiresAt")
+        self._expires[row] = math.nan if expires is None else expires
+        self._set_bit(self._archived, row, details.get("archived", False))
+        self._set_bit(self._live, row, True)
+        extra = {k: v for k, v in details.items()
+                 if k not in ("originalUrl", "createdAt", "expiresAt", "archived")}
+        if extra:
+            self._extra[row] = extra
+        else:
+            self._extra.pop(row, None)
+
+    # -- mapping interface
+
+    def __getitem__(self, code):
+        details = self.get(code)
+        if details is None:
+            raise KeyError(code)
+        return details
+
+    def get(self, code, default=None):
+        packed = pack_code(code)
+        with self._lock:
+            if packed is None:
+                details = self._odd.get(code)
+                return dict(details) if details is not None else default
+            _, row = self._find(packed)
+            return self._read(row) if row is not None else default
+
+    def __contains__(self, code):
+        packed = pack_code(code)
+        with self._lock:
+            if packed is None:
+                return code in self._odd
+            return self._find(packed)[1] is not None
+
+    def __setitem__(self, code, details):
+        packed = pack_code(code)
+        with self._lock:
+            if packed is None:
+                self._odd[code] = dict(details)
+                return
+            position, row = self._find(packed)
+            if row is None:
+                row = self._free.pop() if self._free else len(self._codes)
+                if self._slots[position] == EMPTY:
+                    self._used_slots += 1
+                self._slots[position] = row + 1
+                self._count += 1
+            self._write(row, packed, details)
+            if self._used_slots > len(self._slots) * 0.7:
+                self._resize()
+
+    def __delitem__(self, code):
+        packed = pack_code(code)
+        with self._lock:
+            if packed is None:
+                del self._odd[code]
+                return
+            position, row = self._find(packed)
+            if row is None:
+                raise KeyError(code)
+            self._slots[position] = TOMBSTONE
+            self._set_bit(self._live, row, False)
+            self._garbage += self._lengths[row]
+            self._lengths[row] = 0
+            self._extra.pop(row, None)
+            self._free.append(row)
+            self._count -= 1
+
+    def __len__(self):
+        return self._count + len(self._odd)
+
+    def __iter__(self):
+        with self._lock:
+            codes = [unpack_code(self._codes[row]) for row in range(len(self._codes))
+                     if self._get_bit(self._live, row)]
+            codes.extend(self._odd)
+        return iter(codes)
+
+    def items(self):
+        # Materialized up front so callers may mutate the table while iterating
+        with self._lock:
+            rows = [(unpack_code(self._codes[row]), self._read(row)) for row in range(len(self._codes))
+                    if self._get_bit(self._live, row)]
+            rows.extend((code, dict(details)) for code, details in self._odd.items())
+        return rows
+
+    def nbytes(self):
+        # Bytes held by the columns and index (not the side dicts)
+        columns = (self._codes, self._offsets, self._lengths, self._created, self._expires, self._slots)
+        return (sum(column.buffer_info()[1] * column.itemsize for column in columns)
+                + len(self._arena) + len(self._archived) + len(self._live))
@@ -0,0 +1,76 @@
+import heapq
+import threading
+import time
+
+
+class ExpiryScheduler:
+    # Min-heap of (deadline, shortCode, expiresAt), where the deadline is
+    # expiresAt plus `grace` seconds during which the expired link still
+    # answers 410 rather than 404. A background thread sleeps until the
+    # earliest deadline and hands everything due to `reclaim` in batches, so
+    # the cost is proportional to the number of expirations, never to the
+    # size of the store.
+    #
+    # Rescheduling a code just pushes a new entry; `reclaim` receives the
+    # expiresAt each entry was scheduled with and must skip codes whose
+    # current expiry no longer matches.
+
+    def __init__(self, reclaim, grace=0, batch_size=1000):
+        self.reclaim = reclaim
+        self.grace = grace
+        self.batch_size = batch_size
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, short_code, expires_at):
+        with self._cond:
+            heapq.heappush(self._heap, (expires_at + self.grace, short_code, expires_at))
+            if self._heap[0][1] == short_code:
+                self._cond.notify()
+
+    def due(self, now):
+        batch = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                _, short_code, expires_at = heapq.heappop(self._heap)
+                batch.append((short_code, expires_at))
+        return batch
+
+    def run_once(self, now=None):
+        batch = self.due(now if now is not None else time.time())
+        if batch:
+            self.reclaim(batch)
+        return len(batch)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                with self._cond:
+                    while not self._stopped:
+                        timeout = self._heap[0][0] - time.time() if self._heap else None
+                        if timeout is not None and timeout <= 0:
+                            break
+                        self._cond.wait(timeout)
+                    if self._stopped:
+                        return
+                while self.run_once() == self.batch_size:
+                    pass
+
+        self._thread = threading.Thread(target=run, name="expiry-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,128 @@
+import threading
+from collections import OrderedDict
+
+
+HALVE = bytes(i >> 1 for i in range(256))
+
+
+class FrequencySketch:
+    # Count-Min sketch of recent access frequency with 4-bit saturating
+    # counters. After `sample` increments every counter is halved, so the
+    # estimate follows the current popularity instead of all-time totals.
+
+    def __init__(self, width, depth=4):
+        self.width = 1 << max(4, (width - 1).bit_length())
+        self.mask = self.width - 1
+        self.depth = depth
+        self.table = bytearray(self.width * depth)
+        self.sample = 10 * self.width
+        self.additions = 0
+
+    def _slots(self, key):
+        h = hash(key)
+        for row in range(self.depth):
+            # Cheap independent-ish hashes from one hash() call
+            h = (h * 0x9E3779B1 + row) & 0xFFFFFFFFFFFF
+            yield row * self.width + ((h >> 16) & self.mask)
+
+    def estimate(self, key):
+        return min(self.table[slot] for slot in self._slots(key))
+
+    def increment(self, key):
+        slots = list(self._slots(key))
+        low = min(self.table[slot] for slot in slots)
+        if low >= 15:
+            return
+        for slot in slots:
+            # Conservative update: only raise the counters at the minimum
+            if self.table[slot] == low:
+                self.table[slot] = low + 1
+        self.additions += 1
+        if self.additions >= self.sample:
+            self.table = bytearray(self.table.translate(HALVE))
+            self.additions //= 2
+
+
+class TinyLfuCache:
+    # W-TinyLFU: a small LRU window in front of a segmented LRU main area
+    # (probation + protected). An entry leaving the window only gets into
+    # the main area if the sketch says it is used more often than the entry
+    # it would push out, so one-off lookups can't flush the hot set.
+    #
+    # `generation` goes up on every invalidation. Callers read it before
+    # loading a value and pass it to put(), which drops the value if an
+    # invalidation raced with the load.
+
+    def __init__(self, capacity, window_ratio=0.01, protected_ratio=0.8):
+        self.capacity = capacity
+        self.window_size = max(1, int(capacity * window_ratio))
+        main_size = max(1, capacity - self.window_size)
+        self.protected_size = max(1, int(main_size * protected_ratio))
+        self.main_size = main_size
+        self.sketch = FrequencySketch(capacity)
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.window) + len(self.probation) + len(self.protected)
+
+    def get(self, key):
+        with self._lock:
+            self.sketch.increment(key)
+            if key in self.window:
+                self.window.move_to_end(key)
+                value = self.window[key]
+            elif key in self.protected:
+                self.protected.move_to_end(key)
+                value = self.protected[key]
+            elif key in self.probation:
+                value = self.probation.pop(key)
+                self.protected[key] = value
+                if len(self.protected) > self.protected_size:
+                    demoted, demoted_value = self.protected.popitem(last=False)
+                    self.probation[demoted] = demoted_value
+            else:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self.window or key in self.probation or key in self.protected:
+                return
+            self.window[key] = value
+            if len(self.window) <= self.window_size:
+                return
+            candidate, candidate_value = self.window.popitem(last=False)
+            if len(self.probation) + len(self.protected) < self.main_size:
+                self.probation[candidate] = candidate_value
+                return
+            victim = next(iter(self.probation), None)
+            if victim is None:
+                victim = next(iter(self.protected))
+                self.probation[victim] = self.protected.pop(victim)
+            if self.sketch.estimate(candidate) > self.sketch.estimate(victim):
+                del self.probation[victim]
+                self.probation[candidate] = candidate_value
+
+    def invalidate(self, key):
+        with self._lock:
+            self.generation += 1
+            self.window.pop(key, None)
+            self.probation.pop(key, None)
+            self.protected.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.window.clear()
+            self.probation.clear()
+            self.protected.clear()
@@ -0,0 +1,306 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from snapshot import Snapshot, save_snapshot
+
+
+DURABILITY = ("fsync", "write", "async")
+
+
+class JournalFull(Exception):
+    # Raised by append() when the writer is too far behind; nothing was
+    # queued, so the caller can fail the request without side effects
+    pass
+
+
+class Journal:
+    # Append-only log of link mutations. `path` holds the last compacted
+    # snapshot (a plain {shortCode: entry} JSON object, same as the old
+    # url_data.json), and every change since then lives in numbered log
+    # files next to it, one per shard: url_data.json.<generation>.<shard>.log
+    #
+    # Records carry the full entry after the change, so replaying a log on
+    # top of a snapshot that already contains some of it is harmless. A
+    # short code always maps to a single shard within a generation, so
+    # replaying generation by generation keeps each code's history in order.
+    #
+    # append() for a shard must be serialized by the caller, normally by
+    # holding that shard's lock in the store. It only queues the record: a
+    # writer thread takes everything queued so far, writes it as one group
+    # and then flushes (and with durability="fsync", fsyncs) each file once,
+    # so concurrent writers share the cost. append() returns a ticket, and
+    # wait(ticket) blocks until the record is durable to the configured
+    # level: on disk ("fsync"), in the OS ("write"), or not at all ("async").
+    # At most `max_queued` records wait for the writer; beyond that
+    # append() raises JournalFull.
+    #
+    # With binary=True the snapshot is a snapshot.Snapshot file instead. It
+    # is mapped rather than loaded: load() leaves it in `base` and returns
+    # only the changes replayed from the logs, with deleted codes as None.
+    #
+    # Each function in `listeners` is called as listener(kind, seconds,
+    # nbytes) after the writer commits a group ("group") and after each
+    # compaction ("compact", with the new snapshot's size).
+
+    def __init__(self, path, locks, compact_every=10000, compact_interval=60, binary=False,
+                 durability="write", max_queued=10000):
+        if durability not in DURABILITY:
+            raise ValueError("Unknown durability: %r" % durability)
+        self.path = path
+        self.binary = binary
+        self.base = None
+        self.locks = locks
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self.generation = 0
+        self._pending = [0] * len(locks)
+        self.durability = durability
+        self.max_queued = max_queued
+        # Queue state is guarded by _queue_cond. Only the writer thread
+        # touches the open log files: {shard: (generation, file)}.
+        self._files = {}
+        self._queue = collections.deque()
+        self._queue_cond = threading.Condition()
+        self._ticket = 0
+        self._written = 0
+        self.groups = 0
+        self.listeners = []
+        self._error = None
+        self._closing = False
+        self._writer = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._writer.start()
+        self._compacting = threading.Lock()
+        self._wakeup = threading.Event()
+        self._compactor = None
+
+    @property
+    def pending(self):
+        return sum(self._pending)
+
+    def _log_path(self, generation, shard):
+        return "%s.%d.%d.log" % (self.path, generation, shard)
+
+    def _logs(self):
+        # (generation, shard, path) for every log on disk, oldest first.
+        # Logs written before sharding (url_data.json.<generation>.log)
+        # sort as shard -1.
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + "."
+        logs = []
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name.endswith(".log"):
+                parts = name[len(prefix):-len(".log")].split(".")
+                if 1 <= len(parts) <= 2 and all(p.isdigit() for p in parts):
+                    shard = int(parts[1]) if len(parts) == 2 else -1
+                    logs.append((int(parts[0]), shard, os.path.join(directory, name)))
+        return sorted(logs)
+
+    def load(self):
+        store = {}
+        if self.binary:
+            if os.path.exists(self.path):
+                self.base = Snapshot(self.path)
+        elif os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                try:
+                    store = json.load(f)
+                except Exception:
+                    store = {}
+        logs = self._logs()
+        for generation, shard, log_path in logs:
+            if os.path.getsize(log_path) == 0:
+                os.remove(log_path)
+                continue
+            self._pending[0] += replay(log_path, store, tombstones=self.binary)
+        # Always start a fresh generation so a restart never appends to a
+        # file that may end in a torn record, or with a different shard count.
+        self.generation = logs[-1][0] + 1 if logs else 1
+        return store
+
+    def append(self, shard, op, short_code, entry=None):
+        record = {"op": op, "shortCode": short_code}
+        if entry is not None:
+            record["url"] = entry
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._queue_cond:
+            if len(self._queue) >= self.max_queued:
+                raise JournalFull("%d journal records waiting to be written" % len(self._queue))
+            ticket = self._enqueue(shard, line)
+        self._pending[shard] += 1
+        if self._pending[shard] * len(self._pending) >= self.compact_every:
+            self._wakeup.set()
+        return ticket
+
+    def _enqueue(self, shard, line):
+        # Callers hold _queue_cond; line=None asks the writer to close the
+        # files of the generation being sealed
+        self._ticket += 1
+        self._queue.append((self._ticket, self.generation, shard, line))
+        self._queue_cond.notify_all()
+        return self._ticket
+
+    def wait(self, ticket):
+        # Block until the record behind `ticket` is as durable as configured
+        if ticket is not None and self.durability != "async":
+            self._wait_written(ticket)
+
+    def _wait_written(self, ticket):
+        with self._queue_cond:
+            while self._written < ticket and self._error is None:
+                self._queue_cond.wait()
+            if self._error is not None:
+                raise self._error
+
+    def _write_loop(self):
+        while True:
+            with self._queue_cond:
+                while not self._queue and not self._closing:
+                    self._queue_cond.wait()
+                if not self._queue:
+                    return
+                group = list(self._queue)
+                self._queue.clear()
+            started = time.perf_counter()
+            nbytes = 0
+            try:
+                touched = set()
+                for _, generation, shard, line in group:
+                    if line is None:
+                        self._sync(touched)
+                        touched = set()
+                        self._close_files()
+                        continue
+                    generation_file = self._files.get(shard)
+                    if generation_file is None or generation_file[0] != generation:
+                        if generation_file is not None:
+                            self._sync([generation_file[1]])
+                            touched.discard(generation_file[1])
+                            generation_file[1].close()
+                        generation_file = (generation, open(self._log_path(generation, shard), "a"))
+                        self._files[shard] = generation_file
+                    f = generation_file[1]
+                    f.write(line)
+                    nbytes += len(line)
+                    touched.add(f)
+                self._sync(touched)
+            except OSError as e:
+                with self._queue_cond:
+                    self._error = e
+                    self._queue_cond.notify_all()
+                return
+            with self._queue_cond:
+                self._written = group[-1][0]
+                self.groups += 1
+                self._queue_cond.notify_all()
+            self._notify("group", time.perf_counter() - started, nbytes)
+
+    def _sync(self, files):
+        for f in files:
+            f.flush()
+            if self.durability == "fsync":
+                os.fsync(f.fileno())
+
+    def _close_files(self):
+        for _, f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def _rotate(self):
+        # Called with every shard lock held. Returns the ticket after which
+        # the sealed generation's logs are complete and closed.
+        sealed = self.generation
+        with self._queue_cond:
+            ticket = self._enqueue(None, None)
+            self.generation += 1
+        self._pending = [0] * len(self._pending)
+        return sealed, ticket
+
+    def compact(self, copy_store, installed=None):
+        # Every shard lock is held while copy_store() runs and the logs
+        # rotate, so the snapshot covers everything in the sealed logs.
+        # copy_store() returns a {shortCode: entry} dict, or in binary mode
+        # (shortCode, entry) pairs in code order, which may be produced
+        # lazily after the locks are released. installed() runs once the
+        # new snapshot is in place.
+        with self._compacting:
+            started = time.perf_counter()
+            for lock in self.locks:
+                lock.acquire()
+            try:
+                state = copy_store()
+                sealed, ticket = self._rotate()
+            finally:
+                for lock in reversed(self.locks):
+                    lock.release()
+            if self.binary:
+                save_snapshot(self.path, state)
+            else:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(state, f, separators=(",", ":"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            if installed is not None:
+                installed()
+            self._notify("compact", time.perf_counter() - started, os.path.getsize(self.path))
+            self._wait_written(ticket)
+            sealed = [log_path for generation, _, log_path in self._logs() if generation <= sealed]
+            for log_path in sealed:
+                try:
+                    os.remove(log_path)
+                except FileNotFoundError:
+                    pass
+
+    def _notify(self, kind, seconds, nbytes):
+        for listener in self.listeners:
+            listener(kind, seconds, nbytes)
+
+    def start_compactor(self, copy_store, installed=None):
+        if self._compactor is not None:
+            return
+
+        def run():
+            while True:
+                self._wakeup.wait(self.compact_interval)
+                self._wakeup.clear()
+                if self.pending:
+                    self.compact(copy_store, installed)
+
+        self._compactor = threading.Thread(target=run, name="journal-compactor", daemon=True)
+        self._compactor.start()
+
+    def close(self):
+        # Write out everything queued, then stop the writer
+        with self._queue_cond:
+            self._closing = True
+            self._queue_cond.notify_all()
+        self._writer.join()
+        self._close_files()
+
+
+def replay(log_path, store, tombstones=False):
+    count = 0
+    with open(log_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash mid-append leaves a torn last line; skip it.
+                continue
+            apply_record(store, record, tombstones)
+            count += 1
+    return count
+
+
+def apply_record(store, record, tombstones=False):
+    if record["op"] == "delete":
+        if tombstones:
+            store[record["shortCode"]] = None
+        else:
+            store.pop(record["shortCode"], None)
+    else:
+        store[record["shortCode"]] = record["url"]
@@ -0,0 +1,39 @@
+from codegen import ALPHABET
+
+
+# Redirect statuses a link may ask for, and the longest Cache-Control
+# max-age (seconds)
+REDIRECT_STATUSES = (301, 302, 307, 308)
+MAX_AGE_LIMIT = 365 * 86400
+
+# Characters allowed in a short code: those the allocator draws from, so
+# a code is always a single path segment with nothing to escape
+CODE_CHARS = frozenset(ALPHABET)
+MAX_CODE_LENGTH = 64
+# Paths the app serves itself
+RESERVED_CODES = frozenset(("metrics",))
+
+
+def is_valid_code(short_code):
+    return (isinstance(short_code, str) and 0 < len(short_code) <= MAX_CODE_LENGTH
+            and CODE_CHARS.issuperset(short_code) and short_code not in RESERVED_CODES)
+
+
+def parse_policy(data):
+    # redirectStatus / maxAge from a request body, as the fields to store
+    # (None resets one to the default). Returns (fields, error).
+    fields = {}
+    if "redirectStatus" in data:
+        status = data["redirectStatus"]
+        # 301.0 == 301, but only an int makes a valid status line
+        if status is not None and (isinstance(status, bool) or not isinstance(status, int)
+                                   or status not in REDIRECT_STATUSES):
+            return None, "redirectStatus must be one of %s" % ", ".join(map(str, REDIRECT_STATUSES))
+        fields["redirectStatus"] = status
+    if "maxAge" in data:
+        max_age = data["maxAge"]
+        if max_age is not None and (isinstance(max_age, bool) or not isinstance(max_age, int)
+                                    or not 0 <= max_age <= MAX_AGE_LIMIT):
+            return None, "maxAge must be a whole number of seconds up to %d" % MAX_AGE_LIMIT
+        fields["maxAge"] = max_age
+    return fields, None
@@ -0,0 +1,278 @@
+import atexit
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+
+# Upper bounds in seconds, for latencies from a cache hit to a slow fsync
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    # A monotonic count per combination of label values
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.reset()
+
+    def reset(self):
+        # Without labels the single series exists from the start, at zero
+        self.values = {} if self.labels else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def state(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+    def merge(self, values, rows):
+        for labels, value in rows:
+            labels = tuple(labels)
+            values[labels] = values.get(labels, 0) + value
+
+    def samples(self, values):
+        for labels, value in sorted(values.items()):
+            yield self.name, self.labels, labels, value
+
+
+class Histogram:
+    # Fixed buckets per combination of label values. Each row keeps a
+    # count per bucket (the last one unbounded) followed by the sum, so an
+    # observation is one bisect and two additions.
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.reset()
+
+    def reset(self):
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self.values.get(labels)
+            if row is None:
+                row = self.values[labels] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def state(self):
+        with self._lock:
+            return [[list(labels), list(row)] for labels, row in self.values.items()]
+
+    def merge(self, values, rows):
+        for labels, row in rows:
+            labels = tuple(labels)
+            mine = values.get(labels)
+            if mine is None:
+                values[labels] = list(row)
+            else:
+                values[labels] = [a + b for a, b in zip(mine, row)]
+
+    def samples(self, values):
+        bounds = [format_value(b) for b in self.buckets] + ["+Inf"]
+        for labels, row in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, row):
+                cumulative += count
+                yield self.name + "_bucket", self.labels + ("le",), labels + (bound,), cumulative
+            yield self.name + "_sum", self.labels, labels, row[-1]
+            yield self.name + "_count", self.labels, labels, cumulative
+
+
+class Gauge:
+    # Read from `fn` at scrape time in the scraping process, so gauges are
+    # never written to or merged from other processes
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+
+class TimedLock:
+    # Wraps a lock and observes how long each acquire() waited. An
+    # uncontended acquire is recorded as zero without reading the clock.
+
+    def __init__(self, lock, histogram, *labels):
+        self._lock = lock
+        self._histogram = histogram
+        self._labels = labels
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self._histogram.observe(0.0, *self._labels)
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        self._histogram.observe(time.perf_counter() - started, *self._labels)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value)) if value >= 1 else repr(value)
+    return repr(value)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    # Counters, histograms and gauges rendered in the Prometheus text
+    # format.
+    #
+    # With `directory`, every process writes its counters and histograms to
+    # <directory>/<pid>.json every `interval` seconds and at exit, and
+    # render() adds up the files of every other process, so a scrape that
+    # reaches any worker reports them all. Files of exited workers are kept
+    # so totals never go backwards; empty the directory when the whole
+    # service restarts.
+
+    def __init__(self, directory=None, interval=5.0):
+        self.directory = directory
+        self.interval = interval
+        self.metrics = {}
+        self._stop = threading.Event()
+        self._thread = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Metric %r registered twice" % metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn):
+        return self._add(Gauge(name, help, fn))
+
+    def state(self):
+        return {
+            name: metric.state() for name, metric in self.metrics.items() if metric.kind != "gauge"
+        }
+
+    def _path(self, pid):
+        return os.path.join(self.directory, "%d.json" % pid)
+
+    def dump(self):
+        # Replace this process's file with its current totals
+        path = self._path(os.getpid())
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state(), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def _others(self):
+        # States written by every process but this one
+        own = "%d.json" % os.getpid()
+        for name in os.listdir(self.directory):
+            if name.endswith(".json") and name != own:
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        yield json.load(f)
+                except (OSError, ValueError):
+                    # Removed, or replaced between listdir() and open()
+                    continue
+
+    def collect(self):
+        # {name: {labels: value}} summed over this process and, with a
+        # directory, every other one
+        totals = {}
+        states = [self.state()]
+        if self.directory is not None:
+            states.extend(self._others())
+        for state in states:
+            for name, rows in state.items():
+                metric = self.metrics.get(name)
+                if metric is not None:
+                    metric.merge(totals.setdefault(name, {}), rows)
+        return totals
+
+    def render(self):
+        totals = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append("# HELP %s %s" % (name, escape(metric.help)))
+            lines.append("# TYPE %s %s" % (name, metric.kind))
+            if metric.kind == "gauge":
+                lines.append("%s %s" % (name, format_value(metric.fn())))
+                continue
+            for sample, label_names, label_values, value in metric.samples(totals.get(name, {})):
+                if label_names:
+                    labels = ",".join('%s="%s"' % (k, escape(v)) for k, v in zip(label_names, label_values))
+                    lines.append("%s{%s} %s" % (sample, labels, format_value(value)))
+                else:
+                    lines.append("%s %s" % (sample, format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    def start(self):
+        # Write this process's file periodically (only with a directory)
+        if self.directory is None or self._thread is not None:
+            return
+        self._spawn()
+        atexit.register(self.stop)
+        # A worker forked from a preloaded app starts from zero and writes
+        # its own file; what happened before the fork is in the parent's
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _spawn(self):
+        def run():
+            while not self._stop.wait(self.interval):
+                self.dump()
+
+        self._thread = threading.Thread(target=run, name="metrics-writer", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        for metric in self.metrics.values():
+            if metric.kind != "gauge":
+                metric.reset()
+        self._stop = threading.Event()
+        self._spawn()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.dump()
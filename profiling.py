@@ -0,0 +1,149 @@
+"""cProfile runs of single requests, captured on demand.
+
+List and summarize what was captured:
+
+    python profiling.py list profiles
+    python profiling.py show profiles <id> --sort tottime
+    python profiling.py summary profiles --route api_urls
+"""
+import argparse
+import cProfile
+import hmac
+import itertools
+import json
+import os
+import pstats
+import random
+import threading
+import time
+
+
+class RequestProfiler:
+    # Decides which requests to profile and stores the results: one that
+    # sends the configured token, or a `sample` fraction of all requests.
+    # Each capture is <id>.prof (pstats format) plus <id>.json with what
+    # the request was, and only the newest `keep` captures are kept.
+    #
+    # Only one request per process is profiled at a time; others that
+    # qualify meanwhile run unprofiled.
+
+    def __init__(self, directory, token=None, sample=0.0, keep=100):
+        self.directory = directory
+        self.token = token.encode("utf-8") if token is not None else None
+        self.sample = sample
+        self.keep = keep
+        self._busy = threading.Lock()
+        self._ids = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+
+    def trigger(self, token=None):
+        # Why this request should be profiled ("token" or "sample"), or None
+        # Compared as bytes: compare_digest() rejects non-ASCII str
+        if (self.token is not None and token is not None
+                and hmac.compare_digest(token.encode("utf-8", "surrogateescape"), self.token)):
+            return "token"
+        if self.sample > 0 and random.random() < self.sample:
+            return "sample"
+        return None
+
+    def start(self):
+        # A running profiler, or None if another request is being profiled
+        if not self._busy.acquire(False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Some other profiler or tracer owns the hook
+            self._busy.release()
+            return None
+        return profile
+
+    def new_id(self):
+        return "%d-%d-%d" % (time.time() * 1000, os.getpid(), next(self._ids))
+
+    def finish(self, profile, profile_id=None, **metadata):
+        # Stop `profile`, write it out with `metadata` and return its id
+        profile.disable()
+        self._busy.release()
+        profile_id = profile_id or self.new_id()
+        path = os.path.join(self.directory, profile_id)
+        profile.dump_stats(path + ".prof")
+        with open(path + ".json", "w") as f:
+            json.dump(dict(metadata, id=profile_id, pid=os.getpid()), f)
+        self._rotate()
+        return profile_id
+
+    def _rotate(self):
+        captures = list_profiles(self.directory)
+        for meta in captures[:max(0, len(captures) - self.keep)]:
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.directory, meta["id"] + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+def list_profiles(directory):
+    # Metadata of every capture in `directory`, oldest first
+    captures = []
+    for name in os.listdir(directory):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                # Rotated away, or still being written
+                continue
+    captures.sort(key=lambda meta: (meta.get("time", 0), meta["id"]))
+    return captures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="one line per captured request")
+    listing.add_argument("directory")
+    show = commands.add_parser("show", help="stats of one capture")
+    show.add_argument("directory")
+    show.add_argument("id", help="capture id, or -1 for the newest")
+    summary = commands.add_parser("summary", help="stats of every capture, added together")
+    summary.add_argument("directory")
+    summary.add_argument("--route", help="only captures of this route")
+    for command in (show, summary):
+        command.add_argument("--sort", default="cumulative", help="pstats sort key (default cumulative)")
+        command.add_argument("--limit", type=int, default=25, help="functions to print")
+    args = parser.parse_args()
+
+    captures = list_profiles(args.directory)
+    if args.command == "list":
+        print("%-28s %-20s %-7s %-10s %6s %9s %s" % (
+            "id", "time", "method", "route", "status", "ms", "shortCode / trigger"))
+        for meta in captures:
+            print("%-28s %-20s %-7s %-10s %6s %9.2f %s / %s" % (
+                meta["id"], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(meta["time"])),
+                meta["method"], meta["route"], meta["status"], meta["duration"] * 1e3,
+                meta.get("shortCode") or "-", meta["trigger"]))
+        return
+
+    if args.command == "show":
+        if args.id.lstrip("-").isdigit():
+            # A position in the listing; real ids contain dashes
+            selected = captures[int(args.id):][:1]
+        else:
+            selected = [meta for meta in captures if meta["id"] == args.id]
+    else:
+        selected = [meta for meta in captures if args.route is None or meta["route"] == args.route]
+    if not selected:
+        parser.error("No matching profiles in %s" % args.directory)
+    if args.command == "show":
+        print("%(method)s %(path)s -> %(status)s in %(duration).4fs (%(trigger)s)" % selected[0])
+    else:
+        total = sum(meta["duration"] for meta in selected)
+        print("%d requests, %.4fs in total" % (len(selected), total))
+    stats = pstats.Stats(*(os.path.join(args.directory, meta["id"] + ".prof") for meta in selected))
+    stats.sort_stats(args.sort).print_stats(args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import json
+import os
+import time
+
+
+class PurgeLog:
+    # Short codes whose cached redirects are stale, appended to a file as
+    # one JSON line each so every worker process writes to the same log
+    # and an edge cache's purger can follow it. A position in the log is
+    # the byte offset after the last line read; the file may be truncated
+    # once consumers have caught up, and a position past its end then
+    # starts over from the beginning.
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def record(self, short_code):
+        # One write() per line: appends from different processes never
+        # interleave within a line
+        line = json.dumps({"shortCode": short_code, "at": time.time()}, separators=(",", ":"))
+        os.write(self._fd, (line + "\n").encode("utf-8"))
+
+    def read(self, after=0, limit=1000):
+        # (entries, position) for up to `limit` lines after `after`
+        entries = []
+        with open(self.path, "rb") as f:
+            if after > os.fstat(f.fileno()).st_size:
+                after = 0
+            f.seek(after)
+            position = after
+            for line in f:
+                if len(entries) >= limit or not line.endswith(b"\n"):
+                    # Stop at the limit, or at a line still being written
+                    break
+                entries.append(json.loads(line))
+                position += len(line)
+        return entries, position
+
+    def close(self):
+        os.close(self._fd)
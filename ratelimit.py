@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+UNITS = {"s": 1, "m": 60, "h": 3600}
+
+# route=rate/unit:burst. "probe" is spent by redirects that end in a 404;
+# a "<route>.key" rule, when present, applies to recognised API keys.
+DEFAULT_LIMITS = "redirect=50/s:100,shorten=1/s:20,api=10/s:50,probe=10/m:20"
+
+
+def parse_limits(spec, base=None):
+    # {"route": (tokens per second, burst)} from "route=rate/unit:burst,...",
+    # on top of the rules in `base`
+    limits = dict(base or {})
+    for rule in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            route, value = rule.split("=")
+            rate, _, burst = value.partition(":")
+            count, _, unit = rate.partition("/")
+            per_second = float(count) / UNITS[unit or "s"]
+            burst = float(burst) if burst else max(1.0, float(count))
+        except (KeyError, ValueError):
+            raise ValueError("Bad rate limit rule %r (expected route=rate/unit:burst)" % rule)
+        if per_second <= 0 or burst < 1:
+            raise ValueError("Rate limit %r must allow at least one request" % rule)
+        limits[route.strip()] = (per_second, burst)
+    return limits
+
+
+class TokenBuckets:
+    # One token bucket per client in a bounded LRU table. A check touches
+    # one entry and expires at most two idle ones, so every call is O(1)
+    # and memory stays at `capacity` buckets however many clients appear.
+    #
+    # A bucket left alone for burst / rate seconds has refilled completely
+    # and is indistinguishable from a new one, so idle buckets are dropped
+    # from the cold end as checks go by. When the table is full of active
+    # clients the least recently seen is dropped anyway, which hands it a
+    # fresh bucket next time; size the table above the number of clients
+    # active within that window.
+
+    def __init__(self, rate, burst, capacity=100000):
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self.idle = burst / rate
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _expire(self, now):
+        for _ in range(2):
+            if not self._buckets:
+                return
+            _, (_, stamp) = next(iter(self._buckets.items()))
+            if now - stamp < self.idle and len(self._buckets) < self.capacity:
+                return
+            self._buckets.popitem(last=False)
+
+    def _tokens(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.burst
+        return min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def take(self, key, cost=1, now=None):
+        # Spend `cost` tokens. Returns 0 if allowed, otherwise the seconds
+        # until the bucket will hold enough; nothing is spent then.
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            if tokens < cost:
+                return (cost - tokens) / self.rate
+            self._expire(now)
+            self._buckets[key] = (tokens - cost, now)
+            self._buckets.move_to_end(key)
+            return 0
+
+    def peek(self, key, cost=1, now=None):
+        # Like take() without spending anything
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+        return 0 if tokens >= cost else (cost - tokens) / self.rate
+
+
+class RateLimiter:
+    # Token buckets per route and client. A client is its API key when it
+    # sends one of `api_keys` in X-API-Key, otherwise its IP address, so
+    # unknown keys can't be rotated to get fresh buckets.
+
+    def __init__(self, limits, api_keys=(), capacity=100000):
+        self.api_keys = frozenset(api_keys)
+        self.tables = {
+            route: TokenBuckets(rate, burst, capacity) for route, (rate, burst) in limits.items()
+        }
+
+    def _table(self, route, remote_addr, api_key):
+        if api_key and api_key in self.api_keys:
+            table = self.tables.get(route + ".key")
+            return table if table is not None else self.tables.get(route), "key:" + api_key
+        return self.tables.get(route), "ip:" + (remote_addr or "")
+
+    def take(self, route, remote_addr, api_key=None):
+        table, client = self._table(route, remote_addr, api_key)
+        return table.take(client) if table is not None else 0
+
+    def peek(self, route, remote_addr, api_key=None):
+        table, client = self._table(route, remote_addr, api_key)
+        return table.peek(client) if table is not None else 0
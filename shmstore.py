@@ -0,0 +1,512 @@
+"""Link table in a memory-mapped file shared by every worker process.
+
+Import an existing JSON data file (and any journal logs next to it):
+
+    python shmstore.py url_data.json url_data.shm
+
+Reclaim the arena space of replaced and deleted records, with every worker
+stopped (optionally resizing the table):
+
+    python shmstore.py --compact url_data.shm [--slots N] [--arena-size BYTES]
+"""
+import argparse
+import bisect
+import fcntl
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+from urlindex import canonical_url, url_key
+
+
+MAGIC = b"URLSHM01"
+HEADER_SIZE = 4096
+
+# magic, code slots, url slots, arena size, sequence, links, used code
+# slots, used url slots, arena bytes used, mutations
+HEADER = struct.Struct("<8sQQQQQQQQQ")
+SEQ_OFFSET = 32
+# hash of the key (never 0), record offset or code slot + 1 (0 = deleted)
+SLOT = struct.Struct("<QQ")
+# code length, URL length, extra JSON length, createdAt, expiresAt (NaN
+# when unset), flags; followed by the code, URL and extra bytes
+RECORD = struct.Struct("<HIIddB")
+
+ARCHIVED = 1
+KNOWN_FIELDS = ("originalUrl", "createdAt", "archived", "expiresAt")
+MAX_LOAD = 0.7
+
+
+class StoreFull(Exception):
+    pass
+
+
+def key_hash(data):
+    # Stable across processes, unlike hash(); 0 marks an empty slot
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little") | 1
+
+
+class FileLock:
+    # flock() on an open file behind a lock's acquire()/release()
+
+    def __init__(self, f):
+        self._file = f
+
+    def acquire(self, blocking=True, timeout=-1):
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def release(self):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+
+
+class ShmStore:
+    # Every worker maps the same file, so links are held once per machine
+    # and a write in one worker is visible to the others as soon as it
+    # lands. The file is
+    #
+    #   header | code slots | url slots | arena
+    #
+    # Records are appended to the arena and never modified. Code slots are
+    # an open-addressing table from the hash of a short code to its current
+    # record; url slots index non-archived links by URL digest for dedup.
+    # The file is created sparse at full size, so unused capacity costs
+    # neither memory nor disk; it does not grow, and a full table raises
+    # StoreFull. Every update appends a record and deleted codes keep their
+    # slots, so only compact() gets that space back.
+    #
+    # One process writes at a time (flock on the file, plus a lock between
+    # threads). The writer makes the sequence number odd, updates slots and
+    # counters, then makes it even again. Readers take no lock: they retry
+    # whenever the sequence was odd or changed under them (a seqlock).
+    in_memory = True
+    OPTIONS = ("slots", "arena_size")
+
+    def __init__(self, path, shards=16, durability="write", slots=1 << 20, arena_size=1 << 30):
+        self.path = path
+        self.durability = durability
+        self._file = open(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+        self._thread_lock = threading.RLock()
+        self._file_lock = FileLock(self._file)
+        self._local = threading.local()
+        self._order = None
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._file.fileno()).st_size == 0:
+                self._create(slots, arena_size)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            (magic, self._slots, self._url_slots, self._arena_size,
+             seq, *_) = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise ValueError("%s is not a shared link table" % path)
+            self._code_base = HEADER_SIZE
+            self._url_base = self._code_base + self._slots * SLOT.size
+            self._arena_base = self._url_base + self._url_slots * SLOT.size
+            if seq & 1:
+                # A writer died mid-mutation; recount what made it in
+                self._set_header(count=len(self._live_offsets()))
+                self._set_seq(seq + 1)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _create(self, slots, arena_size):
+        # Slot counts are powers of two so probing can mask instead of mod
+        slots = url_slots = 1 << max(4, (slots - 1).bit_length())
+        self._file.truncate(HEADER_SIZE + (slots + url_slots) * SLOT.size + arena_size)
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, slots, url_slots, arena_size, 0, 0, 0, 0, 0, 0))
+        self._file.flush()
+
+    # -- header
+
+    def _header(self):
+        return HEADER.unpack_from(self._map, 0)
+
+    def _set_header(self, **fields):
+        names = ("magic", "slots", "url_slots", "arena_size", "seq", "count", "used",
+                 "url_used", "arena_used", "mutations")
+        values = dict(zip(names, self._header()))
+        values.update(fields)
+        HEADER.pack_into(self._map, 0, *(values[name] for name in names))
+
+    def _seq(self):
+        return struct.unpack_from("<Q", self._map, SEQ_OFFSET)[0]
+
+    def _set_seq(self, seq):
+        struct.pack_into("<Q", self._map, SEQ_OFFSET, seq)
+
+    # -- lock-free reads
+
+    def _read(self, fn, *args):
+        # Run fn until it sees no write in progress and none completed
+        # during the call. A torn read may raise; that is retried too.
+        while True:
+            before = self._seq()
+            if before & 1:
+                time.sleep(0)
+                continue
+            try:
+                result = fn(*args)
+            except Exception:
+                if self._seq() == before:
+                    raise
+                continue
+            if self._seq() == before:
+                return result
+
+    def _record(self, offset):
+        code_length, url_length, extra_length, created, expires, flags = RECORD.unpack_from(self._map, offset)
+        start = offset + RECORD.size
+        code = self._map[start:start + code_length].decode("utf-8")
+        start += code_length
+        details = {
+            "originalUrl": self._map[start:start + url_length].decode("utf-8"),
+            "createdAt": created,
+            "archived": bool(flags & ARCHIVED),
+        }
+        if not math.isnan(expires):
+            details["expiresAt"] = expires
+        if extra_length:
+            start += url_length
+            details.update(json.loads(self._map[start:start + extra_length]))
+        return code, details
+
+    def _record_code(self, offset):
+        code_length = struct.unpack_from("<H", self._map, offset)[0]
+        start = offset + RECORD.size
+        return self._map[start:start + code_length]
+
+    def _probe(self, base, size, h):
+        # Slot positions for hash h; bounded so a torn table can't spin
+        mask = size - 1
+        position = h & mask
+        for _ in range(size):
+            yield position, base + position * SLOT.size
+            position = (position + 1) & mask
+
+    def _locate(self, short_code):
+        # (code slot, record offset) for short_code; the slot is the first
+        # reusable one when the code is absent, and offset is None
+        code = short_code.encode("utf-8")
+        h = key_hash(code)
+        reusable = None
+        for position, at in self._probe(self._code_base, self._slots, h):
+            stored, offset = SLOT.unpack_from(self._map, at)
+            if stored == 0:
+                return (reusable if reusable is not None else position), None
+            if offset == 0:
+                if reusable is None:
+                    reusable = position
+            elif stored == h and self._record_code(offset) == code:
+                return position, offset
+        return reusable, None
+
+    def _get(self, short_code):
+        _, offset = self._locate(short_code)
+        return self._record(offset)[1] if offset is not None else None
+
+    def _live_offsets(self):
+        # Record offsets of every live link, skipping empty and deleted
+        # slots in C rather than one unpack per slot
+        slots = array("Q")
+        slots.frombytes(self._map[self._code_base:self._url_base])
+        return list(filter(None, slots[1::2]))
+
+    def __contains__(self, short_code):
+        return self._read(self._locate, short_code)[1] is not None
+
+    def __len__(self):
+        return self._header()[5]
+
+    def get(self, short_code):
+        return self._read(self._get, short_code)
+
+    def _find_by_url(self, url):
+        canonical = canonical_url(url)
+        h = self._url_hash(url)
+        for _, at in self._probe(self._url_base, self._url_slots, h):
+            stored, slot = SLOT.unpack_from(self._map, at)
+            if stored == 0:
+                return None
+            if stored == h and slot:
+                _, offset = SLOT.unpack_from(self._map, self._code_base + (slot - 1) * SLOT.size)
+                if offset:
+                    short_code, details = self._record(offset)
+                    if not details["archived"] and canonical_url(details["originalUrl"]) == canonical:
+                        return short_code
+        return None
+
+    def find_by_url(self, url):
+        return self._read(self._find_by_url, url)
+
+    def _codes(self):
+        return sorted(self._record_code(offset).decode("utf-8") for offset in self._live_offsets())
+
+    def scan(self, after=None):
+        # (shortCode, details) in short code order, starting after `after`.
+        # The sorted code list is rebuilt only when some process has written
+        # since it was last built.
+        mutations = self._header()[9]
+        order = self._order
+        if order is None or order[0] != mutations:
+            order = self._order = (mutations, self._read(self._codes))
+        codes = order[1]
+        start = bisect.bisect_right(codes, after) if after is not None else 0
+        for i in range(start, len(codes)):
+            details = self.get(codes[i])
+            if details is not None:
+                yield codes[i], details
+
+    def _expiring(self):
+        found = []
+        for offset in self._live_offsets():
+            short_code, details = self._record(offset)
+            if details.get("expiresAt") is not None:
+                found.append((short_code, details["expiresAt"]))
+        return found
+
+    def expiring(self):
+        # (shortCode, expiresAt) for every link that has an expiry
+        return iter(self._read(self._expiring))
+
+    # -- the single writer
+
+    @contextmanager
+    def _writing(self):
+        # Reentrant: held by url_lock() around a find/put pair and by batch()
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            self._thread_lock.acquire()
+            self._file_lock.acquire()
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                if self.durability == "fsync":
+                    self._map.flush()
+                self._file_lock.release()
+                self._thread_lock.release()
+
+    def instrument_locks(self, wrap):
+        # wrap(lock, kind) returns a stand-in for the lock, e.g. one that
+        # times how long acquiring it waits. Call before serving requests.
+        self._thread_lock = wrap(self._thread_lock, "writer")
+        self._file_lock = wrap(self._file_lock, "file")
+
+    def url_lock(self, url):
+        # Other processes create links too, so dedup needs the writer lock
+        return self._writing()
+
+    def batch(self):
+        # One writer lock (and with durability="fsync", one flush) for the block
+        return self._writing()
+
+    def _append_record(self, short_code, details):
+        code = short_code.encode("utf-8")
+        url = details["originalUrl"].encode("utf-8")
+        extra = {k: v for k, v in details.items() if k not in KNOWN_FIELDS}
+        extra = json.dumps(extra, separators=(",", ":")).encode("utf-8") if extra else b""
+        expires = details.get("expiresAt")
+        record = RECORD.pack(
+            len(code), len(url), len(extra), details.get("createdAt", 0.0),
+            math.nan if expires is None else expires,
+            ARCHIVED if details.get("archived", False) else 0,
+        ) + code + url + extra
+        used = self._header()[8]
+        if used + len(record) > self._arena_size:
+            raise StoreFull("Shared link table arena is full (%d bytes); compact it offline" % self._arena_size)
+        offset = self._arena_base + used
+        self._map[offset:offset + len(record)] = record
+        # Not reachable until a slot points at it, so no seqlock needed yet
+        self._set_header(arena_used=used + len(record))
+        return offset
+
+    @staticmethod
+    def _url_hash(url):
+        return int.from_bytes(url_key(url)[:8], "little") | 1
+
+    def _url_slot(self, details):
+        # (slot address, hash, whether the slot was never used) where
+        # details' URL will be indexed. Found before a write starts, so a
+        # full URL index raises StoreFull with nothing changed.
+        h = self._url_hash(details["originalUrl"])
+        for _, at in self._probe(self._url_base, self._url_slots, h):
+            stored, current = SLOT.unpack_from(self._map, at)
+            if stored == 0 or current == 0:
+                if stored == 0 and self._header()[7] + 1 > self._url_slots * MAX_LOAD:
+                    break
+                return at, h, stored == 0
+        raise StoreFull("Shared link table URL index is full; compact it offline")
+
+    def _index_url(self, url_slot, slot):
+        at, h, fresh = url_slot
+        SLOT.pack_into(self._map, at, h, slot + 1)
+        if fresh:
+            self._set_header(url_used=self._header()[7] + 1)
+
+    def _unindex_url(self, details, slot):
+        h, entry = self._url_hash(details["originalUrl"]), slot + 1
+        for _, at in self._probe(self._url_base, self._url_slots, h):
+            stored, current = SLOT.unpack_from(self._map, at)
+            if stored == 0:
+                return
+            if stored == h and current == entry:
+                SLOT.pack_into(self._map, at, h, 0)
+                return
+
+    def _store(self, short_code, details):
+        # Write details for short_code; returns the previous details or None
+        position, old_offset = self._locate(short_code)
+        if position is None:
+            raise StoreFull("Shared link table has no free slots")
+        old = self._record(old_offset)[1] if old_offset is not None else None
+        header = self._header()
+        if old is None and header[6] + 1 > self._slots * MAX_LOAD:
+            raise StoreFull("Shared link table is full (%d slots); compact it offline" % self._slots)
+        url_slot = self._url_slot(details) if not details.get("archived", False) else None
+        offset = self._append_record(short_code, details)
+        at = self._code_base + position * SLOT.size
+        reused = SLOT.unpack_from(self._map, at)[0] != 0
+        seq = self._seq()
+        self._set_seq(seq + 1)
+        try:
+            if old is not None and not old.get("archived", False):
+                self._unindex_url(old, position)
+            SLOT.pack_into(self._map, at, key_hash(short_code.encode("utf-8")), offset)
+            if url_slot is not None:
+                self._index_url(url_slot, position)
+            header = self._header()
+            self._set_header(
+                count=header[5] + (old is None),
+                used=header[6] + (old is None and not reused),
+                mutations=header[9] + 1,
+            )
+        finally:
+            self._set_seq(seq + 2)
+        return old
+
+    def put(self, short_code, details):
+        with self._writing():
+            self._store(short_code, dict(details))
+
+    def put_many(self, items):
+        # put() each (shortCode, details) under one writer lock
+        with self._writing():
+            for short_code, details in items:
+                self._store(short_code, dict(details))
+
+    def update(self, short_code, fields):
+        # Merge `fields` into the entry; a None value removes that field
+        # (callers only pass None for optional ones: expiresAt, redirectStatus, maxAge)
+        with self._writing():
+            old = self._get(short_code)
+            if old is None:
+                return None
+            details = {k: v for k, v in dict(old, **fields).items() if v is not None}
+            self._store(short_code, details)
+        return details
+
+    def delete(self, short_code):
+        with self._writing():
+            position, offset = self._locate(short_code)
+            if offset is None:
+                return False
+            _, old = self._record(offset)
+            seq = self._seq()
+            self._set_seq(seq + 1)
+            try:
+                if not old.get("archived", False):
+                    self._unindex_url(old, position)
+                at = self._code_base + position * SLOT.size
+                SLOT.pack_into(self._map, at, SLOT.unpack_from(self._map, at)[0], 0)
+                header = self._header()
+                self._set_header(count=header[5] - 1, mutations=header[9] + 1)
+            finally:
+                self._set_seq(seq + 2)
+            return True
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+def compact(path, slots=None, arena_size=None):
+    # Rewrite the table at `path` with only its live records, dropping
+    # superseded records and deleted slots. Workers that have the old file
+    # mapped would go on writing to it, so run this with all of them
+    # stopped. Capacity is kept unless slots / arena_size are given.
+    # Returns (links, arena bytes before, arena bytes after).
+    tmp_path = path + ".compact"
+    old = ShmStore(path)
+    try:
+        with old._writing():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            new = ShmStore(tmp_path, slots=slots or old._slots, arena_size=arena_size or old._arena_size)
+            try:
+                with new.batch():
+                    # In arena order, so links sharing a URL keep their order
+                    for offset in sorted(old._live_offsets()):
+                        new._store(*old._record(offset))
+                before, after = old._header()[8], new._header()[8]
+                links = len(new)
+            except BaseException:
+                new.close()
+                os.remove(tmp_path)
+                raise
+            new.close()
+            os.replace(tmp_path, path)
+    finally:
+        old.close()
+    return links, before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", nargs="?", help="JSON data file; its journal logs are replayed too")
+    parser.add_argument("target", nargs="?", help="shared link table to create or add to")
+    parser.add_argument("--compact", metavar="TABLE", help="compact this table instead of importing")
+    parser.add_argument("--slots", type=int, help="code slots for a new table (default 1048576, or unchanged)")
+    parser.add_argument("--arena-size", type=int, help="arena bytes for a new table (default 1 GiB, or unchanged)")
+    args = parser.parse_args()
+
+    if args.compact is not None:
+        if args.source is not None:
+            parser.error("--compact takes no source or target")
+        started = time.perf_counter()
+        links, before, after = compact(args.compact, args.slots, args.arena_size)
+        print("Compacted %s: %d links, arena %d -> %d bytes in %.1fs" % (
+            args.compact, links, before, after, time.perf_counter() - started))
+        return
+    if args.target is None:
+        parser.error("source and target are required")
+
+    from journal import Journal
+
+    started = time.perf_counter()
+    journal = Journal(args.source, [threading.Lock()])
+    links = journal.load()
+    journal.close()
+    store = ShmStore(args.target, slots=args.slots or 1 << 20, arena_size=args.arena_size or 1 << 30)
+    with store.batch():
+        for short_code, details in links.items():
+            store.put(short_code, details)
+    print("Imported %d links into %s in %.1fs" % (len(links), args.target, time.perf_counter() - started))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
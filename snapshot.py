@@ -0,0 +1,243 @@
+"""Binary link snapshots that are opened with mmap instead of parsed.
+
+Convert an existing JSON data file (and any journal logs next to it):
+
+    python snapshot.py url_data.json url_data.snap
+"""
+import argparse
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from array import array
+
+from urlindex import canonical_url, url_key
+
+
+MAGIC = b"URLSNAP1"
+
+# magic, links, records offset, url slots offset, url slot count,
+# expiring offset, expiring count
+HEADER = struct.Struct("<8sQQQQQQ")
+# arena offset, code length, URL length, extra JSON length, createdAt,
+# expiresAt (NaN when unset), flags
+RECORD = struct.Struct("<QHIIddB")
+# first 8 bytes of the URL digest, record number + 1 (0 = empty slot)
+URL_SLOT = struct.Struct("<QI")
+EXPIRING = struct.Struct("<I")
+
+ARCHIVED = 1
+KNOWN_FIELDS = ("originalUrl", "createdAt", "archived", "expiresAt")
+
+
+class Snapshot:
+    # A read-only snapshot file laid out as
+    #
+    #   header | arena | records | url slots | expiring
+    #
+    # The arena holds each link's code, URL and any extra fields (as JSON)
+    # back to back. Records are fixed-size and sorted by code, so a lookup
+    # is a binary search and scans come out in code order. The url slots
+    # are an open-addressing table over non-archived links for dedup, and
+    # the expiring section lists the records that have an expiresAt.
+    #
+    # Opening only reads the header; everything else is paged in by the OS
+    # as lookups touch it, and entries are decoded one at a time.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError("%s is not a binary snapshot; convert it with snapshot.py" % path)
+        (_, self._count, self._records, self._slots, self._slot_count,
+         self._expiring, self._expiring_count) = HEADER.unpack_from(self._map, 0)
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, row):
+        return RECORD.unpack_from(self._map, self._records + row * RECORD.size)
+
+    def _code(self, row):
+        offset, code_length = struct.unpack_from("<QH", self._map, self._records + row * RECORD.size)
+        return self._map[offset:offset + code_length]
+
+    def _details(self, row):
+        offset, code_length, url_length, extra_length, created, expires, flags = self._record(row)
+        start = offset + code_length
+        details = {
+            "originalUrl": self._map[start:start + url_length].decode("utf-8"),
+            "createdAt": created,
+            "archived": bool(flags & ARCHIVED),
+        }
+        if not math.isnan(expires):
+            details["expiresAt"] = expires
+        if extra_length:
+            start += url_length
+            details.update(json.loads(self._map[start:start + extra_length]))
+        return details
+
+    def _bisect(self, code):
+        # First row whose code is >= code
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._code(mid) < code:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, short_code):
+        code = short_code.encode("utf-8")
+        row = self._bisect(code)
+        if row < self._count and self._code(row) == code:
+            return row
+        return None
+
+    def __contains__(self, short_code):
+        return self._find(short_code) is not None
+
+    def get(self, short_code):
+        row = self._find(short_code)
+        return self._details(row) if row is not None else None
+
+    def codes(self, after=None):
+        # Short codes in order, starting after `after`
+        row = 0
+        if after is not None:
+            after = after.encode("utf-8")
+            row = self._bisect(after)
+            if row < self._count and self._code(row) == after:
+                row += 1
+        for row in range(row, self._count):
+            yield self._code(row).decode("utf-8")
+
+    def items(self):
+        for row in range(self._count):
+            yield self._code(row).decode("utf-8"), self._details(row)
+
+    def find_by_url(self, url):
+        if not self._slot_count:
+            return None
+        canonical = canonical_url(url)
+        prefix = int.from_bytes(url_key(url)[:8], "little")
+        mask = self._slot_count - 1
+        position = prefix & mask
+        while True:
+            stored, entry = URL_SLOT.unpack_from(self._map, self._slots + position * URL_SLOT.size)
+            if not entry:
+                return None
+            if stored == prefix:
+                details = self._details(entry - 1)
+                if canonical_url(details["originalUrl"]) == canonical:
+                    return self._code(entry - 1).decode("utf-8")
+            position = (position + 1) & mask
+
+    def expiring(self):
+        # (shortCode, expiresAt) for every link with an expiry
+        for i in range(self._expiring_count):
+            (row,) = EXPIRING.unpack_from(self._map, self._expiring + i * EXPIRING.size)
+            yield self._code(row).decode("utf-8"), self._record(row)[5]
+
+
+def write_snapshot(f, items):
+    # Write (shortCode, details) pairs, sorted by short code, to the binary
+    # file object f. Records are spooled to a temporary file so only the
+    # dedup hashes (12 bytes a link) are held in memory.
+    f.write(bytes(HEADER.size))
+    offset = HEADER.size
+    count = 0
+    previous = None
+    prefixes = array("Q")
+    prefix_rows = array("I")
+    expiring = array("I")
+    with tempfile.TemporaryFile() as records:
+        for short_code, details in items:
+            code = short_code.encode("utf-8")
+            if previous is not None and code <= previous:
+                raise ValueError("Snapshot items must be sorted by short code: %r" % short_code)
+            previous = code
+            url = details["originalUrl"].encode("utf-8")
+            extra = {k: v for k, v in details.items() if k not in KNOWN_FIELDS}
+            extra = json.dumps(extra, separators=(",", ":")).encode("utf-8") if extra else b""
+            expires = details.get("expiresAt")
+            archived = details.get("archived", False)
+            records.write(RECORD.pack(
+                offset, len(code), len(url), len(extra), details.get("createdAt", 0.0),
+                math.nan if expires is None else expires, ARCHIVED if archived else 0,
+            ))
+            f.write(code)
+            f.write(url)
+            f.write(extra)
+            offset += len(code) + len(url) + len(extra)
+            if not archived:
+                prefixes.append(int.from_bytes(url_key(details["originalUrl"])[:8], "little"))
+                prefix_rows.append(count)
+            if expires is not None:
+                expiring.append(count)
+            count += 1
+        records_offset = offset
+        records.seek(0)
+        shutil.copyfileobj(records, f)
+    offset += count * RECORD.size
+
+    # Url slots at most half full, probed linearly from the digest
+    slot_count = 1
+    while slot_count < 2 * len(prefixes):
+        slot_count *= 2
+    slot_count = slot_count if prefixes else 0
+    taken = array("I", bytes(4 * slot_count))
+    for i, prefix in enumerate(prefixes):
+        position = prefix & (slot_count - 1)
+        while taken[position]:
+            position = (position + 1) & (slot_count - 1)
+        taken[position] = i + 1
+    slots = bytearray(slot_count * URL_SLOT.size)
+    for position, i in enumerate(taken):
+        if i:
+            URL_SLOT.pack_into(slots, position * URL_SLOT.size, prefixes[i - 1], prefix_rows[i - 1] + 1)
+    f.write(slots)
+    slots_offset = offset
+    offset += len(slots)
+
+    f.write(expiring.tobytes())
+    f.seek(0)
+    f.write(HEADER.pack(MAGIC, count, records_offset, slots_offset, slot_count, offset, len(expiring)))
+    return count
+
+
+def save_snapshot(path, items):
+    # Write to a temporary file next to `path`, then swap it in atomically
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w+b") as f:
+        count = write_snapshot(f, items)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="JSON data file; its journal logs are replayed too")
+    parser.add_argument("target", help="binary snapshot to write")
+    args = parser.parse_args()
+
+    from journal import Journal
+
+    started = time.perf_counter()
+    links = Journal(args.source, [threading.Lock()]).load()
+    count = save_snapshot(args.target, sorted(links.items()))
+    print("Wrote %d links to %s in %.1fs" % (count, args.target, time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
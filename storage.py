@@ -0,0 +1,508 @@
+import bisect
+import heapq
+import itertools
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from compactstore import CompactTable
+from journal import Journal, JournalFull  # noqa: F401 (re-exported)
+from shmstore import ShmStore, StoreFull  # noqa: F401 (re-exported)
+from snapshot import Snapshot
+from urlindex import UrlIndex, canonical_url, url_key
+
+
+class LockStripes:
+    # A fixed set of locks picked by hashing a key
+
+    def __init__(self, count):
+        self.locks = [threading.Lock() for _ in range(count)]
+
+    def slot(self, key):
+        return hash(key) % len(self.locks)
+
+    def __call__(self, key):
+        return self.locks[self.slot(key)]
+
+    def wrap(self, fn):
+        # Replace each lock with fn(lock), in place: the list may be shared
+        self.locks[:] = [fn(lock) for lock in self.locks]
+
+
+class JsonStore:
+    # The original storage: every link in memory, persisted through the
+    # append-only journal next to the JSON snapshot. Links are split over
+    # lock-striped shards by short code; a mutation and its journal record
+    # only ever hold the owning shard's lock.
+    #
+    # Lock order: url_lock() -> shard lock -> url index stripe.
+    #
+    # With compact=True each shard is a CompactTable instead of a dict of
+    # dicts, trading a little CPU per read for far less memory per link.
+    #
+    # With binary=True the snapshot is a memory-mapped snapshot.Snapshot
+    # that serves as a read-only base layer. The shards then only hold
+    # links changed since it was written, plus per-shard sets of deleted
+    # codes that hide their base entries; startup no longer depends on the number of
+    # links. Each compaction writes a new base and drops the overlay
+    # entries it now covers.
+    in_memory = True
+    OPTIONS = ("compact", "binary", "max_queued")
+
+    def __init__(self, path, shards=16, compact=False, binary=False, durability="write", max_queued=10000):
+        self._stripes = LockStripes(shards)
+        self._url_locks = LockStripes(shards)
+        self.journal = Journal(
+            path, self._stripes.locks, binary=binary, durability=durability, max_queued=max_queued
+        )
+        self._shards = [CompactTable() if compact else {} for _ in range(shards)]
+        self._deleted = [set() for _ in range(shards)]
+        changes = self.journal.load()
+        self._base = self.journal.base
+        for short_code, details in changes.items():
+            slot = self._stripes.slot(short_code)
+            if details is not None:
+                self._shards[slot][short_code] = details
+            elif self._base is not None and short_code in self._base:
+                self._deleted[slot].add(short_code)
+        self._index = UrlIndex(shards)
+        self._index.rebuild(dict(self._items()))
+        self._local = threading.local()
+        # Short codes in sorted order for scan(). New codes land in a small
+        # unsorted side list that is merged in once it grows; deleted codes
+        # are skipped on read and dropped at the next merge. Codes in the
+        # base snapshot are merged in from it on the fly.
+        self._order = sorted(code for code, _ in self._items())
+        self._order_new = []
+        self._order_lock = threading.Lock()
+        self._captured = None
+        if binary:
+            self.journal.start_compactor(self._copy_sorted, self._rebase)
+        else:
+            self.journal.start_compactor(self._copy)
+
+    def _items(self):
+        # Links held in the shards (all of them unless there is a base)
+        for shard in self._shards:
+            yield from list(shard.items())
+
+    def _copy(self):
+        return {k: dict(v) for k, v in self._items()}
+
+    def _copy_sorted(self):
+        # Runs under every shard lock: capture the overlay, then merge it
+        # with the base lazily once the locks are released.
+        self._captured = captured = [
+            (dict(shard.items()), set(deleted)) for shard, deleted in zip(self._shards, self._deleted)
+        ]
+        base = self._base
+        changed = {}
+        deleted = set()
+        for links, gone in captured:
+            changed.update(links)
+            deleted |= gone
+        if base is None:
+            return iter(sorted(changed.items()))
+        kept = ((code, details) for code, details in base.items()
+                if code not in changed and code not in deleted)
+        return heapq.merge(sorted(changed.items()), kept, key=lambda item: item[0])
+
+    def _rebase(self):
+        # The snapshot just written covers everything captured by
+        # _copy_sorted(); switch to it and drop what it now holds.
+        base = Snapshot(self.journal.path)
+        captured, self._captured = self._captured, None
+        for lock in self._stripes.locks:
+            lock.acquire()
+        try:
+            for slot, (links, gone) in enumerate(captured):
+                shard = self._shards[slot]
+                for short_code, details in links.items():
+                    if shard.get(short_code) == details:
+                        del shard[short_code]
+                        self._unindex(short_code, details)
+                self._deleted[slot] = {code for code in self._deleted[slot] - gone if code in base}
+            # The old map stays valid for readers still holding it
+            self._base = base
+        finally:
+            for lock in reversed(self._stripes.locks):
+                lock.release()
+
+    def _append(self, slot, op, short_code, details=None):
+        # Queue the journal record; returns the ticket to wait on once the
+        # shard lock is released, or None inside batch()
+        ticket = self.journal.append(slot, op, short_code, details)
+        batch = getattr(self._local, "batch", None)
+        if batch is None:
+            return ticket
+        batch[0] = ticket
+        return None
+
+    @contextmanager
+    def batch(self):
+        # Mutations inside the block are acknowledged together at the end,
+        # with one wait for the journal instead of one per mutation.
+        if getattr(self._local, "batch", None) is not None:
+            yield
+            return
+        self._local.batch = last = [None]
+        try:
+            yield
+        finally:
+            self._local.batch = None
+            self.journal.wait(last[0])
+
+    def _lookup(self, slot, short_code):
+        # The current entry, from the shard or else the base snapshot
+        details = self._shards[slot].get(short_code)
+        if details is None and self._base is not None and short_code not in self._deleted[slot]:
+            return self._base.get(short_code)
+        return details
+
+    def __contains__(self, short_code):
+        slot = self._stripes.slot(short_code)
+        if short_code in self._shards[slot]:
+            return True
+        base = self._base
+        return base is not None and short_code not in self._deleted[slot] and short_code in base
+
+    def __len__(self):
+        count = sum(len(shard) for shard in self._shards)
+        base = self._base
+        if base is not None:
+            count += len(base)
+            count -= sum(1 for deleted in self._deleted for code in deleted if code in base)
+            count -= sum(1 for code, _ in self._items() if code in base)
+        return count
+
+    def instrument_locks(self, wrap):
+        # wrap(lock, kind) returns a stand-in for the lock, e.g. one that
+        # times how long acquiring it waits. Call before serving requests.
+        self._stripes.wrap(lambda lock: wrap(lock, "shard"))
+        self._url_locks.wrap(lambda lock: wrap(lock, "url"))
+
+    def url_lock(self, url):
+        # Held around a find_by_url()/put() pair so two requests for the
+        # same URL can't both miss and create duplicate codes.
+        return self._url_locks(canonical_url(url))
+
+    def get(self, short_code):
+        details = self._lookup(self._stripes.slot(short_code), short_code)
+        return dict(details) if details is not None else None
+
+    def find_by_url(self, url):
+        short_code = self._index.get(url)
+        if short_code is not None and short_code in self:
+            return short_code
+        base = self._base
+        if base is not None:
+            # The base's answer only counts if the link hasn't changed since
+            short_code = base.find_by_url(url)
+            if short_code is not None:
+                details = self.get(short_code)
+                if (details is not None and not details.get("archived", False)
+                        and canonical_url(details["originalUrl"]) == canonical_url(url)):
+                    return short_code
+        return None
+
+    def _ordered_codes(self, after):
+        with self._order_lock:
+            if len(self._order_new) > max(1024, len(self._order) // 64):
+                merged = heapq.merge(self._order, sorted(self._order_new))
+                self._order = [code for code, _ in itertools.groupby(merged)
+                               if code in self._shards[self._stripes.slot(code)]]
+                self._order_new = []
+            main, new = self._order, sorted(self._order_new)
+        start = bisect.bisect_right(main, after) if after is not None else 0
+        new_start = bisect.bisect_right(new, after) if after is not None else 0
+        merged = heapq.merge(
+            (main[i] for i in range(start, len(main))),
+            (new[i] for i in range(new_start, len(new))),
+            self._base.codes(after) if self._base is not None else (),
+        )
+        for code, _ in itertools.groupby(merged):
+            yield code
+
+    def scan(self, after=None):
+        # (shortCode, details) in short code order, starting after `after`
+        for short_code in self._ordered_codes(after):
+            details = self.get(short_code)
+            if details is not None:
+                yield short_code, details
+
+    def expiring(self):
+        # (shortCode, expiresAt) for every link that has an expiry
+        base = self._base
+        if base is not None:
+            for short_code, expires_at in base.expiring():
+                slot = self._stripes.slot(short_code)
+                if short_code not in self._shards[slot] and short_code not in self._deleted[slot]:
+                    yield short_code, expires_at
+        for short_code, details in self._items():
+            if details.get("expiresAt") is not None:
+                yield short_code, details["expiresAt"]
+
+    # Mutations queue their journal record first, so a JournalFull leaves
+    # the store untouched, and wait for it after releasing the shard lock.
+
+    def put(self, short_code, details):
+        details = dict(details)
+        slot = self._stripes.slot(short_code)
+        shard = self._shards[slot]
+        with self._stripes.locks[slot]:
+            old = self._lookup(slot, short_code)
+            ticket = self._append(slot, "create" if old is None else "update", short_code, details)
+            self._unindex(short_code, old)
+            shard[short_code] = details
+            self._deleted[slot].discard(short_code)
+            self._reindex(short_code, details)
+        if old is None:
+            # Under the lock: _ordered_codes() may be swapping the list out
+            with self._order_lock:
+                self._order_new.append(short_code)
+        self.journal.wait(ticket)
+
+    def put_many(self, items):
+        # put() each (shortCode, details), acknowledged together
+        with self.batch():
+            for short_code, details in items:
+                self.put(short_code, details)
+
+    def update(self, short_code, fields):
+        # Merge `fields` into the entry; a None value removes that field
+        # (callers only pass None for optional ones: expiresAt, redirectStatus, maxAge)
+        slot = self._stripes.slot(short_code)
+        shard = self._shards[slot]
+        with self._stripes.locks[slot]:
+            old = self._lookup(slot, short_code)
+            if old is None:
+                return None
+            details = {k: v for k, v in dict(old, **fields).items() if v is not None}
+            ticket = self._append(slot, "update", short_code, details)
+            self._unindex(short_code, old)
+            shard[short_code] = details
+            self._reindex(short_code, details)
+        self.journal.wait(ticket)
+        return dict(details)
+
+    def delete(self, short_code):
+        slot = self._stripes.slot(short_code)
+        with self._stripes.locks[slot]:
+            old = self._lookup(slot, short_code)
+            if old is None:
+                return False
+            ticket = self._append(slot, "delete", short_code)
+            self._shards[slot].pop(short_code, None)
+            if self.journal.binary:
+                # Also when the code isn't in the base yet: a compaction
+                # may be writing it into the next one right now
+                self._deleted[slot].add(short_code)
+            self._unindex(short_code, old)
+        self.journal.wait(ticket)
+        return True
+
+    def _unindex(self, short_code, details):
+        if details is not None and not details.get("archived", False):
+            self._index.discard(details["originalUrl"], short_code)
+
+    def _reindex(self, short_code, details):
+        if not details.get("archived", False):
+            self._index.add(details["originalUrl"], short_code)
+
+    def close(self):
+        self.journal.close()
+
+
+class SqliteStore:
+    # Links in an SQLite table, so the dataset no longer has to fit in RAM.
+    # WAL mode lets redirects read while a write is in flight, and lookups
+    # by short code are a single primary-key probe on a WITHOUT ROWID table.
+    in_memory = False
+    OPTIONS = ()
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS links ("
+        " code TEXT PRIMARY KEY,"
+        " original_url TEXT NOT NULL,"
+        " url_key BLOB NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " archived INTEGER NOT NULL DEFAULT 0,"
+        " expires_at REAL,"
+        " redirect_status INTEGER,"
+        " max_age INTEGER"
+        ") WITHOUT ROWID",
+        # Dedup looks links up by canonical URL digest, not the raw string
+        "CREATE INDEX IF NOT EXISTS links_url_key ON links (url_key) WHERE archived = 0",
+    )
+
+    # Columns added after the first release, created on open if missing
+    MIGRATIONS = (
+        ("expires_at", "ALTER TABLE links ADD COLUMN expires_at REAL"),
+        ("redirect_status", "ALTER TABLE links ADD COLUMN redirect_status INTEGER"),
+        ("max_age", "ALTER TABLE links ADD COLUMN max_age INTEGER"),
+    )
+    # Indexes on migrated columns, created once the columns exist. Only
+    # links with an expiry are indexed, so expiring() reads just those.
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS links_expires_at ON links (expires_at) WHERE expires_at IS NOT NULL",
+    )
+
+    # Statements are kept as constants so sqlite3's per-connection
+    # statement cache reuses the prepared form on every call.
+    COLUMNS = "original_url, created_at, archived, expires_at, redirect_status, max_age"
+    SELECT = "SELECT " + COLUMNS + " FROM links WHERE code = ?"
+    SELECT_BY_KEY = "SELECT code FROM links WHERE url_key = ? AND archived = 0 LIMIT 1"
+    EXISTS = "SELECT 1 FROM links WHERE code = ?"
+    COUNT = "SELECT COUNT(*) FROM links"
+    SCAN = "SELECT code, " + COLUMNS + " FROM links WHERE code > ? ORDER BY code"
+    UPSERT = (
+        "INSERT INTO links (code, original_url, url_key, created_at, archived, expires_at,"
+        " redirect_status, max_age) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT (code) DO UPDATE SET original_url = excluded.original_url,"
+        " url_key = excluded.url_key, created_at = excluded.created_at,"
+        " archived = excluded.archived, expires_at = excluded.expires_at,"
+        " redirect_status = excluded.redirect_status, max_age = excluded.max_age"
+    )
+    DELETE = "DELETE FROM links WHERE code = ?"
+    EXPIRING = "SELECT code, expires_at FROM links WHERE expires_at IS NOT NULL"
+
+    # SQLite commits its own groups through the WAL; durability only picks
+    # how hard each commit syncs
+    SYNCHRONOUS = {"fsync": "FULL", "write": "NORMAL", "async": "OFF"}
+
+    def __init__(self, path, shards=16, durability="write"):
+        if durability not in self.SYNCHRONOUS:
+            raise ValueError("Unknown durability: %r" % durability)
+        self.path = path
+        self.durability = durability
+        self._local = threading.local()
+        self._url_locks = LockStripes(shards)
+        conn = self._conn()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(links)")}
+        for column, statement in self.MIGRATIONS:
+            if column not in columns:
+                conn.execute(statement)
+        for statement in self.INDEXES:
+            conn.execute(statement)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=" + self.SYNCHRONOUS[self.durability])
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _details(row):
+        details = {"originalUrl": row[0], "createdAt": row[1], "archived": bool(row[2])}
+        for field, value in zip(("expiresAt", "redirectStatus", "maxAge"), row[3:]):
+            if value is not None:
+                details[field] = value
+        return details
+
+    def _params(self, short_code, details):
+        return (
+            short_code,
+            details["originalUrl"],
+            url_key(details["originalUrl"]),
+            details.get("createdAt", 0.0),
+            1 if details.get("archived", False) else 0,
+            details.get("expiresAt"),
+            details.get("redirectStatus"),
+            details.get("maxAge"),
+        )
+
+    def __contains__(self, short_code):
+        return self._conn().execute(self.EXISTS, (short_code,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn().execute(self.COUNT).fetchone()[0]
+
+    def instrument_locks(self, wrap):
+        # SQLite's own locks are out of reach; only url_lock() is wrapped
+        self._url_locks.wrap(lambda lock: wrap(lock, "url"))
+
+    def url_lock(self, url):
+        return self._url_locks(canonical_url(url))
+
+    def get(self, short_code):
+        row = self._conn().execute(self.SELECT, (short_code,)).fetchone()
+        return self._details(row) if row is not None else None
+
+    def find_by_url(self, url):
+        row = self._conn().execute(self.SELECT_BY_KEY, (url_key(url),)).fetchone()
+        return row[0] if row is not None else None
+
+    def scan(self, after=None):
+        # (shortCode, details) in short code order, starting after `after`
+        for row in self._conn().execute(self.SCAN, (after if after is not None else "",)):
+            yield row[0], self._details(row[1:])
+
+    def expiring(self):
+        # (shortCode, expiresAt) for every link that has an expiry
+        yield from self._conn().execute(self.EXPIRING)
+
+    def put(self, short_code, details):
+        self._conn().execute(self.UPSERT, self._params(short_code, details))
+
+    def put_many(self, items):
+        # put() each (shortCode, details) in one statement and transaction
+        with self.batch():
+            self._conn().executemany(self.UPSERT, (self._params(code, details) for code, details in items))
+
+    @contextmanager
+    def batch(self):
+        # One transaction for the whole block
+        conn = self._conn()
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def update(self, short_code, fields):
+        with self.batch():
+            conn = self._conn()
+            row = conn.execute(self.SELECT, (short_code,)).fetchone()
+            if row is None:
+                return None
+            details = {k: v for k, v in dict(self._details(row), **fields).items() if v is not None}
+            conn.execute(self.UPSERT, self._params(short_code, details))
+        return details
+
+    def delete(self, short_code):
+        return self._conn().execute(self.DELETE, (short_code,)).rowcount > 0
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+BACKENDS = {
+    "json": JsonStore,
+    "sqlite": SqliteStore,
+    "shm": ShmStore,
+}
+
+
+def open_store(backend, path, shards=16, durability="write", **options):
+    # options are backend specific, listed in each class's OPTIONS
+    try:
+        factory = BACKENDS[backend]
+    except KeyError:
+        raise ValueError("Unknown storage backend: %r" % backend)
+    unsupported = sorted(set(options) - set(factory.OPTIONS))
+    if unsupported:
+        raise ValueError("The %r backend does not take %s" % (backend, ", ".join(unsupported)))
+    return factory(path, shards=shards, durability=durability, **options)
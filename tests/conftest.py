@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    # The app opens its data files in the working directory when imported
+    os.chdir(tmp_path_factory.mktemp("app"))
+    os.environ["URL_CLICKS"] = "0"
+    import urshortner
+    return urshortner.app.test_client()
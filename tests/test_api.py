@@ -0,0 +1,30 @@
+def shorten(client, url, **fields):
+    return client.post("/api/urls", json=dict(fields, originalUrl=url))
+
+
+def test_redirect_status_must_be_an_int(client):
+    for status in (301.0, 308.0, "301", True):
+        response = shorten(client, "https://example.com/status", redirectStatus=status)
+        assert response.status_code == 400
+    response = shorten(client, "https://example.com/status", redirectStatus=301)
+    assert response.status_code == 201
+    code = response.json["shortCode"]
+    assert client.put("/api/urls", json={"shortCode": code, "redirectStatus": 307.0}).status_code == 400
+    assert client.get("/" + code).status_code == 301
+
+
+def post_raw(client, method, body):
+    # NaN and Infinity aren't JSON, so json= can't send them
+    return client.open("/api/urls", method=method, data=body, content_type="application/json")
+
+
+def test_expiry_must_be_finite(client):
+    for value in ("NaN", "Infinity", "-Infinity"):
+        for field in ("ttl", "expiresAt"):
+            body = '{"originalUrl": "https://example.com/expiry", "%s": %s}' % (field, value)
+            assert post_raw(client, "POST", body).status_code == 400
+    code = shorten(client, "https://example.com/expiry").json["shortCode"]
+    for value in ("NaN", "Infinity"):
+        body = '{"shortCode": "%s", "expiresAt": %s}' % (code, value)
+        assert post_raw(client, "PUT", body).status_code == 400
+    assert client.get("/" + code).status_code == 302
@@ -0,0 +1,46 @@
+import io
+
+import pytest
+
+from batch import MALFORMED, guarded, iter_json_array
+
+
+def parse(body, read_size=None):
+    stream = io.BytesIO(body.encode("utf-8"))
+    if read_size is not None:
+        # Feed the parser a few bytes at a time to cross buffer boundaries
+        read = stream.read
+        stream.read = lambda size: read(read_size)
+    return list(guarded(iter_json_array(stream)))
+
+
+@pytest.mark.parametrize("read_size", [None, 1, 3])
+def test_well_formed_arrays(read_size):
+    assert parse("[]", read_size) == []
+    assert parse(" [ ] ", read_size) == []
+    assert parse('[{"a": 1}]', read_size) == [{"a": 1}]
+    assert parse('[1, 22,\n 333 , "x"]', read_size) == [1, 22, 333, "x"]
+
+
+@pytest.mark.parametrize("body, elements", [
+    ("[1 2]", [1]),
+    ('[,,{"a": 1}]', []),
+    ("[,]", []),
+    ("[1,,2]", [1]),
+    ("[1,]", [1]),
+    ("[1, 2", [1, 2]),
+    ("{}", []),
+    (",[1]", []),
+])
+def test_malformed_arrays(body, elements):
+    # Elements before the error are still yielded, then MALFORMED once
+    assert parse(body) == elements + [MALFORMED]
+    assert parse(body, read_size=1) == elements + [MALFORMED]
+
+
+def test_batch_reports_malformed_body(client):
+    response = client.post("/api/urls/batch", data='[{"originalUrl": "https://example.com/b1"} {}]',
+                           content_type="application/json")
+    results = response.json
+    assert [result["status"] for result in results] == [201, 400]
+    assert results[1]["error"] == "Malformed request body"
@@ -0,0 +1,75 @@
+import bisect
+import collections
+import itertools
+import random
+import time
+
+from trending import SlidingTopK, SpaceSaving, Trending
+
+
+def zipf_stream(n, keys, s=1.1, seed=0, prefix="k"):
+    rng = random.Random(seed)
+    weights = list(itertools.accumulate(1 / (k ** s) for k in range(1, keys + 1)))
+    for _ in range(n):
+        yield "%s%d" % (prefix, bisect.bisect_left(weights, rng.random() * weights[-1]))
+
+
+def test_space_saving_bounds():
+    summary = SpaceSaving(100)
+    true = collections.Counter()
+    for key in zipf_stream(50000, 5000):
+        summary.add(key)
+        true[key] += 1
+    max_error = summary.total // summary.capacity
+    assert summary.total == 50000
+    assert len(summary.counts) == 100
+    for key, count in summary.counts.items():
+        assert count - summary.errors[key] <= true[key] <= count
+        assert summary.errors[key] <= max_error
+    for key in true.keys() - summary.counts.keys():
+        assert true[key] <= max_error
+
+
+def test_sliding_window_bounds():
+    window = SlidingTopK(span=60, buckets=6, capacity=50)
+    true = collections.Counter()
+    for bucket in range(6):
+        # Each bucket has its own hot keys, so merged keys miss some buckets
+        for key in zipf_stream(10000, 2000, seed=bucket, prefix="b%d-" % (bucket % 3)):
+            window.add(key, bucket)
+            true[key] += 1
+    window.refresh(now=59)
+    ranking, total = window.top(50)
+    max_error = total // window.capacity
+    assert total == 60000
+    listed = set()
+    for key, count, error in ranking:
+        listed.add(key)
+        assert count - error <= true[key] <= count + max_error
+    for key in true.keys() - listed:
+        assert true[key] <= max_error
+
+
+def test_sliding_window_expires_old_buckets():
+    window = SlidingTopK(span=60, buckets=6, capacity=10)
+    window.add("old", 0, 5)
+    window.add("new", 6, 3)
+    window.refresh(now=65)
+    assert window.top(10) == ([("new", 3, 0)], 3)
+
+
+def test_trending_report():
+    trending = Trending(capacity=20)
+    now = time.time()
+    hits = [(key, now, None) for key in zipf_stream(20000, 1000)]
+    true = collections.Counter(key for key, _, _ in hits)
+    trending.add_hits(hits)
+    report = trending.top("1m", 20)
+    assert report["totalHits"] == 20000
+    assert report["maxError"] == 20000 // 20
+    listed = {link["shortCode"] for link in report["links"]}
+    for link in report["links"]:
+        assert link["count"] - link["error"] <= true[link["shortCode"]] <= link["count"] + report["maxError"]
+    for key, count in true.items():
+        if count > report["maxError"]:
+            assert key in listed
@@ -0,0 +1,142 @@
+import heapq
+import threading
+import time
+
+
+class SpaceSaving:
+    # Space-Saving summary with `capacity` counters. Every key counted more
+    # than N / capacity times (N = total hits added) is guaranteed to be
+    # present, and each reported count overshoots the true count by at most
+    # its `error`, which itself never exceeds N / capacity.
+    #
+    # The smallest counter is found through a min-heap with lazy deletion:
+    # stale (count, key) pairs are skipped when they surface.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        self._heap = []
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, k) for k, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def add(self, key, count=1):
+        self.total += count
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            # Replace the smallest counter; the newcomer inherits its count
+            # as possible overcount.
+            while True:
+                floor, victim = heapq.heappop(self._heap)
+                if self.counts.get(victim) == floor:
+                    break
+            del self.counts[victim]
+            del self.errors[victim]
+            self.counts[key] = floor + count
+            self.errors[key] = floor
+        self._push(key)
+
+
+class SlidingTopK:
+    # Heavy hitters over a sliding window made of `buckets` Space-Saving
+    # summaries, each covering span / buckets seconds. Adding the buckets up
+    # keeps the single-summary bounds for the whole window (N = hits in the
+    # window): a merged count is high by at most the sum of its per-bucket
+    # errors, and a key missing from some buckets is low by at most
+    # N / capacity. So is any key missing from the ranking altogether.
+    #
+    # The merged ranking is rebuilt by refresh() (on every aggregator tick),
+    # so top() is just a slice of a ready list.
+
+    def __init__(self, span, buckets, capacity):
+        self.span = span
+        self.buckets = buckets
+        self.width = span / buckets
+        self.capacity = capacity
+        self._summaries = {}
+        self._ranking = []
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def bucket(self, when):
+        return int(when // self.width)
+
+    def add(self, key, bucket, count=1):
+        summary = self._summaries.get(bucket)
+        if summary is None:
+            summary = self._summaries[bucket] = SpaceSaving(self.capacity)
+        summary.add(key, count)
+
+    def refresh(self, now=None):
+        oldest = self.bucket(now if now is not None else time.time()) - self.buckets + 1
+        for bucket in [b for b in self._summaries if b < oldest]:
+            del self._summaries[bucket]
+        counts = {}
+        errors = {}
+        total = 0
+        for summary in self._summaries.values():
+            total += summary.total
+            for key, count in summary.counts.items():
+                counts[key] = counts.get(key, 0) + count
+                errors[key] = errors.get(key, 0) + summary.errors[key]
+        ranking = heapq.nlargest(self.capacity, counts.items(), key=lambda item: item[1])
+        with self._lock:
+            self._ranking = [(key, count, errors[key]) for key, count in ranking]
+            self._total = total
+
+    def top(self, k):
+        with self._lock:
+            return self._ranking[:k], self._total
+
+
+class Trending:
+    # "Top links right now" over a few sliding windows, fed with the hits the
+    # click aggregator drains from the redirect path.
+
+    WINDOWS = {
+        "1m": (60, 6),
+        "1h": (3600, 60),
+        "1d": (86400, 24),
+    }
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.windows = {
+            name: SlidingTopK(span, buckets, capacity)
+            for name, (span, buckets) in self.WINDOWS.items()
+        }
+
+    def add_hits(self, hits):
+        for window in self.windows.values():
+            counts = {}
+            for short_code, when, _ in hits:
+                key = (short_code, window.bucket(when))
+                counts[key] = counts.get(key, 0) + 1
+            for (short_code, bucket), count in counts.items():
+                window.add(short_code, bucket, count)
+        now = time.time()
+        for window in self.windows.values():
+            window.refresh(now)
+
+    def top(self, window, k):
+        ranking, total = self.windows[window].top(k)
+        return {
+            "window": window,
+            "totalHits": total,
+            # A code's true count lies in [count - error, count + maxError],
+            # and no code outside the list has more than maxError hits.
+            "maxError": total // self.capacity,
+            "links": [
+                {"shortCode": key, "count": count, "error": error}
+                for key, count, error in ranking
+            ],
+        }
@@ -0,0 +1,106 @@
+import functools
+import hashlib
+import threading
+from urllib.parse import urlparse, urlsplit, urlunsplit
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def is_valid_url(url):
+    try:
+        result = urlparse(url)
+        return result.scheme in ("http", "https") and result.netloc != ""
+    except:
+        return False
+
+
+@functools.lru_cache(maxsize=4096)
+def canonical_url(url):
+    # Lowercase scheme and host, drop default ports, and treat "/a" and
+    # "/a/" (and "" and "/") as the same path. Query and fragment are kept.
+    # Cached: creating a link looks its URL up several times in a row (URL
+    # lock, dedup lookup, index update), and bulkio writes a chunk of rows
+    # (fewer than maxsize) right after checking them.
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc
+    try:
+        host = parts.hostname or ""
+        port = parts.port
+    except ValueError:
+        host, port = None, None
+    if host is not None:
+        if ":" in host:
+            host = "[%s]" % host
+        userinfo = netloc.rpartition("@")[0]
+        netloc = (userinfo + "@" if userinfo else "") + host
+        if port is not None and port != DEFAULT_PORTS.get(scheme):
+            netloc += ":%d" % port
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, netloc, path, parts.query, parts.fragment))
+
+
+def url_key(url):
+    return hashlib.blake2b(canonical_url(url).encode("utf-8"), digest_size=16).digest()
+
+
+class UrlIndex:
+    # Reverse index from the digest of a canonical destination URL to the
+    # short codes serving it. Only live (non-archived) links are indexed.
+    # Several live codes can serve one URL (a PUT can point a link at
+    # another's URL); they are kept oldest first, as a bare string in the
+    # usual case of one. The digests are split over lock stripes so
+    # writers to different URLs never contend; these locks are always
+    # taken last.
+
+    def __init__(self, stripes=16):
+        self._codes = [{} for _ in range(stripes)]
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __len__(self):
+        return sum(len(codes) for codes in self._codes)
+
+    def _stripe(self, key):
+        return int.from_bytes(key[:4], "little") % len(self._codes)
+
+    def get(self, url):
+        key = url_key(url)
+        codes = self._codes[self._stripe(key)].get(key)
+        return codes[0] if isinstance(codes, list) else codes
+
+    def add(self, url, short_code):
+        # Returns the first code serving this URL
+        key = url_key(url)
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            codes = self._codes[stripe]
+            existing = codes.setdefault(key, short_code)
+            if isinstance(existing, list):
+                if short_code not in existing:
+                    existing.append(short_code)
+                return existing[0]
+            if existing != short_code:
+                codes[key] = [existing, short_code]
+            return existing
+
+    def discard(self, url, short_code):
+        key = url_key(url)
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            codes = self._codes[stripe]
+            existing = codes.get(key)
+            if isinstance(existing, list):
+                if short_code in existing:
+                    existing.remove(short_code)
+                    if len(existing) == 1:
+                        codes[key] = existing[0]
+            elif existing == short_code:
+                del codes[key]
+
+    def rebuild(self, store):
+        for codes in self._codes:
+            codes.clear()
+        for short_code, details in store.items():
+            if not details.get("archived", False):
+                self.add(details["originalUrl"], short_code)
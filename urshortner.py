@@ -1,53 +1,388 @@
-from flask import Flask, request, jsonify, render_template_string, redirect, abort
-from urllib.parse import urlparse
-import string
-import random
-import threading
+from flask import Flask, Response, g, request, jsonify, render_template_string, redirect, abort, stream_with_context
+import atexit
+import base64
+import functools
+import itertools
+import math
 import time
 import json
 import os
 
+from assets import PrecompressedAsset
+from batch import MALFORMED, chunked, guarded, iter_json_array, iter_ndjson
+from clickstats import ClickStats
+from expiry import ExpiryScheduler
+from codegen import CodeAllocator
+from hotcache import TinyLfuCache
+from linkpolicy import REDIRECT_STATUSES, parse_policy
+from metrics import Registry, TimedLock
+from profiling import RequestProfiler
+from purgelog import PurgeLog
+from ratelimit import DEFAULT_LIMITS, RateLimiter, parse_limits
+from storage import JournalFull, StoreFull, open_store
+from trending import Trending
+from urlindex import is_valid_url
+
 app = Flask(__name__)
 
 
-DATA_FILE = "url_data.json"
-LOCK = threading.Lock()
+# Storage backend: "json" (in-memory dict + journaled JSON file), "sqlite",
+# or "shm" (a memory-mapped table shared by all worker processes)
+STORAGE_BACKEND = os.environ.get("URL_STORAGE", "json")
 
+# Snapshot format for the json backend: "json", or "binary" to memory-map
+# the snapshot instead of parsing it at startup
+SNAPSHOT_FORMAT = os.environ.get("URL_SNAPSHOT", "json")
 
-if os.path.exists(DATA_FILE):
-    with open(DATA_FILE, "r") as f:
-        try:
-            url_store = json.load(f)
-        except Exception:
-            url_store = {}
+if STORAGE_BACKEND == "sqlite":
+    DATA_FILE = os.environ.get("URL_DATA_FILE", "url_data.db")
+elif STORAGE_BACKEND == "shm":
+    DATA_FILE = os.environ.get("URL_DATA_FILE", "url_data.shm")
+elif SNAPSHOT_FORMAT == "binary":
+    DATA_FILE = os.environ.get("URL_DATA_FILE", "url_data.snap")
 else:
-    url_store = {}
+    DATA_FILE = os.environ.get("URL_DATA_FILE", "url_data.json")
+
+
+# Number of lock-striped shards the store is split into
+SHARDS = int(os.environ.get("URL_SHARDS", "16"))
+
+
+# Keep the json backend's links in packed columns rather than a dict per link
+COMPACT_STORE = os.environ.get("URL_COMPACT_STORE", "0") == "1"
+
+# When a write is acknowledged: "fsync" (on disk), "write" (handed to the
+# OS) or "async" (queued). Writes are committed in groups by a writer
+# thread; past URL_WRITE_QUEUE queued writes, mutations get a 503.
+DURABILITY = os.environ.get("URL_DURABILITY", "write")
+WRITE_QUEUE = int(os.environ.get("URL_WRITE_QUEUE", "10000"))
+
+
+# Capacity of a new shm table: code slots, and bytes for link records
+SHM_SLOTS = int(os.environ.get("URL_SHM_SLOTS", str(1 << 20)))
+SHM_ARENA = int(os.environ.get("URL_SHM_ARENA", str(1 << 30)))
 
+STORE_OPTIONS = {
+    "json": dict(compact=COMPACT_STORE, binary=SNAPSHOT_FORMAT == "binary", max_queued=WRITE_QUEUE),
+    "shm": dict(slots=SHM_SLOTS, arena_size=SHM_ARENA),
+}
 
-def save_data():
-    with LOCK:
-        with open(DATA_FILE, "w") as f:
-            json.dump(url_store, f, indent=2)
 
+store = open_store(
+    STORAGE_BACKEND, DATA_FILE, shards=SHARDS, durability=DURABILITY,
+    **STORE_OPTIONS.get(STORAGE_BACKEND, {})
+)
+atexit.register(store.close)
 
-def generate_short_code(length=6):
-    chars = string.ascii_letters + string.digits
+
+# Short codes come from a scrambled counter reserved in blocks per process;
+# set URL_CODE_NODE=i/N on each of N machines that don't share DATA_FILE.
+CODE_BLOCK = int(os.environ.get("URL_CODE_BLOCK", "1000"))
+CODE_NODE, CODE_NODES = (int(n) for n in os.environ.get("URL_CODE_NODE", "0/1").split("/"))
+
+allocator = CodeAllocator(DATA_FILE + ".seq", block_size=CODE_BLOCK, node=CODE_NODE, nodes=CODE_NODES)
+
+
+# Prebuilt redirect responses for the hottest codes (0 disables the cache).
+# Not used with sqlite or shm, which other processes can write to: their
+# updates couldn't invalidate it. shm lookups are already memory reads.
+REDIRECT_CACHE_SIZE = int(os.environ.get("URL_REDIRECT_CACHE", "10000"))
+
+if REDIRECT_CACHE_SIZE > 0 and STORAGE_BACKEND not in ("sqlite", "shm"):
+    redirect_cache = TinyLfuCache(REDIRECT_CACHE_SIZE)
+else:
+    redirect_cache = None
+
+
+# Redirect status and Cache-Control max-age (seconds, 0 for no caching
+# headers) for links that don't set their own redirectStatus / maxAge
+REDIRECT_STATUS = int(os.environ.get("URL_REDIRECT_STATUS", "302"))
+REDIRECT_MAX_AGE = int(os.environ.get("URL_REDIRECT_MAX_AGE", "0"))
+
+if REDIRECT_STATUS not in REDIRECT_STATUSES:
+    raise ValueError("URL_REDIRECT_STATUS must be one of %s" % (REDIRECT_STATUSES,))
+
+# Codes whose cached redirects went stale (updated, deleted or reclaimed)
+# are appended here for edge caches to purge; see /api/purges. Unset
+# disables the log.
+PURGE_LOG = os.environ.get("URL_PURGE_LOG") or None
+
+purge_log = PurgeLog(PURGE_LOG) if PURGE_LOG else None
+if purge_log is not None:
+    atexit.register(purge_log.close)
+
+
+def invalidate(short_code):
+    # Forget cached redirects for short_code, here and at the edge
+    if redirect_cache is not None:
+        redirect_cache.invalidate(short_code)
+    if purge_log is not None:
+        purge_log.record(short_code)
+
+
+# Per-link click counts, collected off the redirect path (URL_CLICKS=0 disables)
+CLICKS_ENABLED = os.environ.get("URL_CLICKS", "1") != "0"
+CLICKS_FILE = os.environ.get("URL_CLICKS_FILE", "url_clicks.db")
+CLICK_BUFFER = int(os.environ.get("URL_CLICK_BUFFER", "65536"))
+CLICK_INTERVAL = float(os.environ.get("URL_CLICK_INTERVAL", "5"))
+# Unique visitors are estimated per link and per window of this many seconds
+UNIQUES_WINDOW = int(os.environ.get("URL_UNIQUES_WINDOW", "86400"))
+
+clicks = ClickStats(
+    CLICKS_FILE, buffer_size=CLICK_BUFFER, interval=CLICK_INTERVAL, uniques_window=UNIQUES_WINDOW
+) if CLICKS_ENABLED else None
+# Counters kept per sliding window for /api/trending
+TRENDING_CAPACITY = int(os.environ.get("URL_TRENDING_CAPACITY", "1000"))
+
+trending = Trending(TRENDING_CAPACITY) if clicks is not None else None
+
+if clicks is not None:
+    clicks.listeners.append(trending.add_hits)
+    clicks.start()
+    atexit.register(clicks.stop)
+
+
+def reclaim_expired(due, backoff=1):
+    # Delete links whose expiry has passed, persisting them as one batch.
+    # Entries rescheduled since (different expiresAt) are left alone.
+    with store.batch():
+        for i, (short_code, expires_at) in enumerate(due):
+            details = store.get(short_code)
+            if details is not None and details.get('expiresAt') == expires_at:
+                try:
+                    store.delete(short_code)
+                except JournalFull:
+                    # Requests come first; the scheduler retries the rest
+                    # after `backoff` seconds
+                    for short_code, expires_at in due[i:]:
+                        expirations.schedule(short_code, expires_at)
+                    if backoff:
+                        time.sleep(backoff)
+                    return
+                invalidate(short_code)
+
+
+def schedule_existing():
+    # One pass at startup; after that only new expiries are scheduled
+    for short_code, expires_at in store.expiring():
+        expirations.schedule(short_code, expires_at)
+
+
+# Seconds an expired link keeps answering 410 before it is deleted
+EXPIRY_GRACE = float(os.environ.get("URL_EXPIRY_GRACE", "3600"))
+
+expirations = ExpiryScheduler(reclaim_expired, grace=EXPIRY_GRACE)
+schedule_existing()
+expirations.start()
+
+
+# Requests run under cProfile when they send X-Profile-Token matching
+# URL_PROFILE_TOKEN, and a URL_PROFILE_SAMPLE fraction of all others. The
+# newest URL_PROFILE_KEEP captures stay in URL_PROFILE_DIR; list them with
+# `python profiling.py list profiles`. With neither set, no hook is installed.
+PROFILE_TOKEN = os.environ.get("URL_PROFILE_TOKEN") or None
+PROFILE_SAMPLE = float(os.environ.get("URL_PROFILE_SAMPLE", "0"))
+PROFILE_DIR = os.environ.get("URL_PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("URL_PROFILE_KEEP", "100"))
+
+
+def start_profile():
+    trigger = profiler.trigger(request.headers.get('X-Profile-Token'))
+    if trigger is not None:
+        profile = profiler.start()
+        if profile is not None:
+            g.profile = (profile, trigger, time.perf_counter())
+
+
+def finish_profile(status, profile_id=None):
+    # Returns a function that stops the profile and saves it; it needs no
+    # request context, so a streamed body can call it once sent. The
+    # request body is left alone then: the response is still reading it.
+    profile, trigger, started = g.pop('profile')
+    body = request.get_json(silent=True) if request.is_json and profile_id is None else None
+    short_code = (request.view_args or {}).get('short_code')
+    if short_code is None and isinstance(body, dict):
+        short_code = body.get('shortCode')
+    metadata = dict(
+        route=request.endpoint or 'unmatched', method=request.method, path=request.full_path.rstrip('?'),
+        shortCode=short_code, status=status, trigger=trigger,
+    )
+
+    def finish():
+        return profiler.finish(
+            profile, profile_id, duration=time.perf_counter() - started, time=time.time(), **metadata
+        )
+    return finish
+
+
+def profiled_response(response):
+    if 'profile' in g:
+        if response.is_streamed:
+            # The real work (batch operations, NDJSON listings) happens
+            # while the body is sent, so keep profiling until then
+            profile_id = profiler.new_id()
+            response.call_on_close(finish_profile(response.status_code, profile_id))
+        else:
+            profile_id = finish_profile(response.status_code)()
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def profiled_teardown(exc):
+    # Only reached with the profile still running if the request failed
+    # before a response was made
+    if 'profile' in g:
+        finish_profile(None)()
+
+
+if PROFILE_TOKEN is not None or PROFILE_SAMPLE > 0:
+    profiler = RequestProfiler(PROFILE_DIR, token=PROFILE_TOKEN, sample=PROFILE_SAMPLE, keep=PROFILE_KEEP)
+    app.before_request(start_profile)
+    app.after_request(profiled_response)
+    app.teardown_request(profiled_teardown)
+else:
+    profiler = None
+
+
+# Prometheus metrics at /metrics (URL_METRICS=1 enables them). With several
+# worker processes, point URL_METRICS_DIR at a directory they all share,
+# emptied when the service restarts, so any worker's /metrics reports the
+# totals of all of them.
+METRICS_ENABLED = os.environ.get("URL_METRICS", "0") == "1"
+METRICS_DIR = os.environ.get("URL_METRICS_DIR") or None
+METRICS_INTERVAL = float(os.environ.get("URL_METRICS_INTERVAL", "5"))
+
+
+def observe_request(route, method, status, seconds):
+    if metrics is not None:
+        request_seconds.observe(seconds, route, method)
+        responses.inc(route, str(status))
+
+
+def observe_persist(kind, seconds, nbytes):
+    persist_seconds.observe(seconds, kind)
+    persist_bytes.inc(kind, amount=nbytes)
+
+
+def data_file_size():
+    return os.path.getsize(DATA_FILE) if os.path.exists(DATA_FILE) else 0
+
+
+if METRICS_ENABLED:
+    metrics = Registry(METRICS_DIR, interval=METRICS_INTERVAL)
+    request_seconds = metrics.histogram(
+        "urlshortener_request_seconds", "Time to build a response", ("route", "method"))
+    responses = metrics.counter(
+        "urlshortener_responses_total", "Responses by route and status code", ("route", "status"))
+    lock_wait = metrics.histogram(
+        "urlshortener_lock_wait_seconds", "Time spent waiting for store locks", ("lock",))
+    persist_seconds = metrics.histogram(
+        "urlshortener_persist_seconds", "Time to commit a journal write group or a compaction", ("kind",))
+    persist_bytes = metrics.counter(
+        "urlshortener_persist_bytes_total", "Bytes written to journal logs and snapshots", ("kind",))
+    code_retries = metrics.counter(
+        "urlshortener_short_code_retries_total", "Allocated short codes skipped because they were taken")
+    metrics.gauge("urlshortener_links", "Links in the store", lambda: len(store))
+    metrics.gauge("urlshortener_data_file_bytes", "Size of the data file", data_file_size)
+    store.instrument_locks(lambda lock, kind: TimedLock(lock, lock_wait, kind))
+    if hasattr(store, "journal"):
+        store.journal.listeners.append(observe_persist)
+    metrics.start()
+else:
+    metrics = None
+
+
+@app.before_request
+def start_request_timer():
+    if metrics is not None:
+        g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        observe_request(request.endpoint or 'unmatched', request.method, response.status_code,
+                        time.perf_counter() - started)
+    return response
+
+
+# Token-bucket rate limits per client (URL_RATE_LIMIT=1 enables them).
+# URL_RATE_LIMITS overrides rules from ratelimit.DEFAULT_LIMITS, e.g.
+# "shorten=5/m:10,shorten.key=10/s:100"; URL_API_KEYS lists the X-API-Key
+# values that get buckets of their own.
+RATE_LIMIT = os.environ.get("URL_RATE_LIMIT", "0") == "1"
+RATE_TABLE = int(os.environ.get("URL_RATE_TABLE", "100000"))
+
+if RATE_LIMIT:
+    limiter = RateLimiter(
+        parse_limits(os.environ.get("URL_RATE_LIMITS", ""), parse_limits(DEFAULT_LIMITS)),
+        api_keys=filter(None, os.environ.get("URL_API_KEYS", "").split(",")),
+        capacity=RATE_TABLE,
+    )
+else:
+    limiter = None
+
+
+def rate_limit(route, remote_addr, api_key=None):
+    # Seconds the client must wait before `route` is served again, or 0.
+    # Redirects are also refused while its 404 probe budget is spent.
+    if limiter is None or route is None:
+        return 0
+    if route == 'redirect':
+        wait = limiter.peek('probe', remote_addr, api_key)
+        if wait:
+            return wait
+    return limiter.take(route, remote_addr, api_key)
+
+
+def note_not_found(remote_addr, api_key=None):
+    # A redirect that found nothing spends the client's probe budget
+    if limiter is not None:
+        limiter.take('probe', remote_addr, api_key)
+
+
+def route_for(endpoint, method):
+    # Which rate limit applies to a Flask endpoint
+    if endpoint == 'redirect_to_url':
+        return 'redirect'
+    if endpoint == 'api_urls_batch' or (endpoint == 'api_urls' and method == 'POST'):
+        return 'shorten'
+    if endpoint is not None and endpoint.startswith('api_'):
+        return 'api'
+    return None
+
+
+@app.before_request
+def check_rate_limit():
+    wait = rate_limit(route_for(request.endpoint, request.method), request.remote_addr,
+                      request.headers.get('X-API-Key'))
+    if wait:
+        response = jsonify(error='Too many requests')
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(wait))
+        return response
+
+
+@app.after_request
+def count_not_found(response):
+    if request.endpoint == 'redirect_to_url' and response.status_code == 404:
+        note_not_found(request.remote_addr, request.headers.get('X-API-Key'))
+    return response
+
+
+def generate_short_code():
+    # Allocated codes never repeat; this only skips codes that the old
+    # random generator happened to hand out already.
     while True:
-        code = ''.join(random.choices(chars, k=length))
-        if code not in url_store:
+        code = allocator.next_code()
+        if code not in store:
             return code
+        if metrics is not None:
+            code_retries.inc()
 
-def is_valid_url(url):
-    try:
-        result = urlparse(url)
-        return result.scheme in ("http", "https") and result.netloc != ""
-    except:
-        return False
 
-@app.route('/')
-def index():
-    
-    return render_template_string("""
+INDEX_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -995,69 +1330,427 @@ def index():
 </script>
 </body>
 </html>
-    """)
+    """
 
+# Seconds browsers may reuse the index page before revalidating its ETag
+INDEX_MAX_AGE = int(os.environ.get("URL_INDEX_MAX_AGE", "300"))
 
-@app.route('/<short_code>')
-def redirect_to_url(short_code):
+# The index page has no template variables, so render it once at startup
+# and serve the stored bytes (with gzip/Brotli variants) on every request.
+with app.app_context():
+    index_page = PrecompressedAsset(
+        render_template_string(INDEX_TEMPLATE).encode("utf-8"),
+        "text/html; charset=utf-8",
+        max_age=INDEX_MAX_AGE,
+    )
+
+
+@app.route('/')
+def index():
+    return index_page.respond(request)
+
+
+def metrics_page():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Only routed when enabled; otherwise /metrics stays an ordinary short code
+if metrics is not None:
+    app.add_url_rule('/metrics', 'metrics_page', metrics_page)
+
+
+# Returned by redirect_parts() for links whose expiry has passed
+GONE = object()
+# Returned by parse_expiry() when the body sets no expiry at all
+MISSING = object()
+
+
+def is_expired(details, now=None):
+    expires_at = details.get("expiresAt")
+    return expires_at is not None and (now if now is not None else time.time()) >= expires_at
+
+
+# Headers set by cache_headers()
+CACHE_HEADERS = ('Surrogate-Key', 'Cache-Control')
+
+
+def cache_headers(short_code, max_age, expires_at, now):
+    # Surrogate-Key names the link so an edge cache can purge it; a link
+    # that expires is never cacheable past its expiry
+    headers = [('Surrogate-Key', 'link:' + short_code)]
+    if expires_at is not None:
+        max_age = min(max_age, int(expires_at - now))
+    if max_age > 0:
+        headers.append(('Cache-Control', 'public, max-age=%d' % max_age))
+    return headers
+
+
+def redirect_parts(short_code, visitor=None):
+    # (body, status, headers) of the redirect for short_code, GONE if the
+    # link has expired, or None if there is nothing to redirect to. Hot
+    # codes come from the cache, and every redirect served is counted as a
+    # click from `visitor`.
+    cached = redirect_cache.get(short_code) if redirect_cache is not None else None
+    if cached is not None:
+        parts, expires_at, max_age = cached
+        if expires_at is not None:
+            now = time.time()
+            if now >= expires_at:
+                return GONE
+            if max_age > 0:
+                # The max-age left shrinks as expiry approaches
+                body, status, headers = parts
+                headers = [h for h in headers if h[0] not in CACHE_HEADERS]
+                parts = (body, status, headers + cache_headers(short_code, max_age, expires_at, now))
+        if clicks is not None:
+            clicks.record(short_code, visitor=visitor)
+        return parts
+    generation = redirect_cache.generation if redirect_cache is not None else None
     # Redirect to original URL if exists
-    url_obj = url_store.get(short_code)
+    url_obj = store.get(short_code)
     if url_obj and not url_obj.get("archived", False):
-        return redirect(url_obj["originalUrl"], code=302)
-    else:
-        abort(404)
+        now = time.time()
+        expires_at = url_obj.get("expiresAt")
+        if is_expired(url_obj, now):
+            return GONE
+        max_age = url_obj.get("maxAge", REDIRECT_MAX_AGE)
+        response = redirect(url_obj["originalUrl"], code=url_obj.get("redirectStatus", REDIRECT_STATUS))
+        headers = list(response.headers) + cache_headers(short_code, max_age, expires_at, now)
+        parts = (response.get_data(), response.status_code, headers)
+        if redirect_cache is not None:
+            redirect_cache.put(short_code, (parts, expires_at, max_age), generation)
+        if clicks is not None:
+            clicks.record(short_code, visitor=visitor)
+        return parts
+    return None
+
+
+def visitor_id(remote_addr, user_agent):
+    return '%s %s' % (remote_addr or '', user_agent or '')
 
 
-@app.route('/api/urls', methods=['GET', 'POST', 'PUT', 'DELETE'])
-def api_urls():
-    global url_store
-    data = request.json
-    if request.method == 'GET':
-        
-        all_urls = [dict(shortCode=k, **v) for k, v in url_store.items() if not v.get('archived', False)]
-        return jsonify(urls=all_urls)
-
-    elif request.method == 'POST':
-        
-        orig_url = data.get('originalUrl', '')
-        if not orig_url or not is_valid_url(orig_url):
-            return jsonify(error='Invalid URL'), 400
+@app.route('/<short_code>')
+def redirect_to_url(short_code):
+    parts = redirect_parts(short_code, visitor_id(request.remote_addr, request.user_agent.string))
+    if parts is None:
+        abort(404)
+    if parts is GONE:
+        abort(410)
+    body, status, headers = parts
+    return Response(body, status, headers)
+
+
+def parse_expiry(data):
+    # expiresAt (epoch seconds, or null for no expiry) or ttl (seconds from
+    # now) from a request body. Returns (value, error); value is MISSING if
+    # neither was given.
+    if 'ttl' in data:
+        ttl = data['ttl']
+        # Flask's JSON parser accepts NaN and Infinity
+        if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or not math.isfinite(ttl) or ttl <= 0:
+            return None, 'ttl must be a positive number of seconds'
+        return time.time() + ttl, None
+    if 'expiresAt' in data:
+        expires_at = data['expiresAt']
+        if expires_at is not None and (isinstance(expires_at, bool) or not isinstance(expires_at, (int, float))
+                                       or not math.isfinite(expires_at)):
+            return None, 'expiresAt must be a timestamp in seconds'
+        return expires_at, None
+    return MISSING, None
+
+
+def shed_when_busy(fn):
+    # Mutations answer 503 instead of queueing without bound when the
+    # store's writer is too far behind, and 507 when a shm table is full
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except JournalFull:
+            return dict(error='Too many pending writes, try again shortly'), 503
+        except StoreFull:
+            return dict(error='Link store is full'), 507
+    return wrapper
+
+
+@shed_when_busy
+def create_link(orig_url, expires_at=None, policy=None):
+    # Shorten orig_url, reusing the existing code if it was shortened before
+    # (an existing link keeps its own expiry and redirect policy). Returns
+    # (body, status) for the POST branch of api_urls.
+    if not orig_url or not is_valid_url(orig_url):
+        return dict(error='Invalid URL'), 400
+    with store.url_lock(orig_url):
         # Check if already shortened
-        for short_code, details in url_store.items():
-            if details['originalUrl'] == orig_url and not details.get('archived', False):
-                return jsonify(shortCode=short_code, url=details), 200
+        short_code = store.find_by_url(orig_url)
+        if short_code is not None:
+            details = store.get(short_code)
+            if details is not None and is_expired(details):
+                # Expired but not reclaimed yet; make room for a fresh code.
+                # No backoff under the URL lock: if the journal is full the
+                # scheduler reclaims it later.
+                reclaim_expired([(short_code, details['expiresAt'])], backoff=0)
+            elif details is not None:
+                return dict(shortCode=short_code, url=details), 200
         short_code = generate_short_code()
-        url_store[short_code] = {
+        details = {
             "originalUrl": orig_url,
             "createdAt": time.time(),
             "archived": False
         }
-        save_data()
-        return jsonify(shortCode=short_code, url=url_store[short_code]), 201
+        if expires_at is not None:
+            details["expiresAt"] = expires_at
+        if policy:
+            details.update((k, v) for k, v in policy.items() if v is not None)
+        store.put(short_code, details)
+    if expires_at is not None:
+        expirations.schedule(short_code, expires_at)
+    return dict(shortCode=short_code, url=details), 201
+
+
+@shed_when_busy
+def update_link(short_code, data):
+    if not short_code or short_code not in store:
+        return dict(error='Short code not found'), 404
+    # Update entry fields (allow archiving)
+    fields = {f: data[f] for f in ('originalUrl', 'archived') if f in data}
+    if 'originalUrl' in fields and not is_valid_url(fields['originalUrl']):
+        return dict(error='Invalid URL'), 400
+    # The store drops fields set to None; only optional ones may be cleared
+    if 'archived' in fields and fields['archived'] is None:
+        return dict(error='archived cannot be null'), 400
+    expires_at, error = parse_expiry(data)
+    if error:
+        return dict(error=error), 400
+    if expires_at is not MISSING:
+        fields['expiresAt'] = expires_at
+    policy, error = parse_policy(data)
+    if error:
+        return dict(error=error), 400
+    fields.update(policy)
+    if not fields:
+        return dict(error='No valid fields provided'), 400
+    if store.update(short_code, fields) is None:
+        return dict(error='Short code not found'), 404
+    invalidate(short_code)
+    if expires_at is not MISSING and expires_at is not None:
+        expirations.schedule(short_code, expires_at)
+    return dict(success=True), 200
+
+
+@shed_when_busy
+def delete_link(short_code):
+    if not short_code or not store.delete(short_code):
+        return dict(error='Short code not found'), 404
+    invalidate(short_code)
+    return dict(success=True), 200
+
+
+# Largest page GET /api/urls?limit= will return
+MAX_PAGE = 1000
+
+
+def encode_cursor(short_code):
+    return base64.urlsafe_b64encode(short_code.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+
+
+def live_urls(after=None):
+    now = time.time()
+    for k, v in store.scan(after):
+        if not v.get('archived', False) and not is_expired(v, now):
+            yield dict(shortCode=k, **v)
+
+
+def list_urls(args, accept):
+    # GET /api/urls. With no parameters this is the full list, as before.
+    #   ?limit=N[&cursor=...]  one page in short code order, plus `next`
+    #   ?format=ndjson         every live link streamed one per line
+    try:
+        after = decode_cursor(args['cursor']) if args.get('cursor') else None
+        limit = int(args['limit']) if args.get('limit') else None
+    except ValueError:
+        return dict(error='Invalid cursor or limit'), 400
+    if limit is not None and not 0 < limit <= MAX_PAGE:
+        return dict(error='limit must be between 1 and %d' % MAX_PAGE), 400
+
+    if args.get('format') == 'ndjson' or accept == 'application/x-ndjson':
+        urls = live_urls(after)
+        if limit is not None:
+            urls = itertools.islice(urls, limit)
+        return (json.dumps(u) + '\n' for u in urls), 200
+
+    if limit is None and after is None:
+        return dict(urls=list(live_urls())), 200
+
+    page = list(itertools.islice(live_urls(after), (limit or MAX_PAGE) + 1))
+    next_cursor = None
+    if len(page) > (limit or MAX_PAGE):
+        page.pop()
+        next_cursor = encode_cursor(page[-1]['shortCode'])
+    return dict(urls=page, next=next_cursor), 200
+
+
+@app.route('/api/urls', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def api_urls():
+    if request.method == 'GET':
+        body, status = list_urls(request.args, request.accept_mimetypes.best)
+        if isinstance(body, dict):
+            return jsonify(body), status
+        return Response(body, mimetype='application/x-ndjson')
+
+    data = request.json
+    if request.method == 'POST':
+        expires_at, error = parse_expiry(data)
+        if not error:
+            policy, error = parse_policy(data)
+        if error:
+            return jsonify(error=error), 400
+        body, status = create_link(data.get('originalUrl', ''), None if expires_at is MISSING else expires_at, policy)
+        return jsonify(body), status
 
     elif request.method == 'PUT':
-        short_code = data.get('shortCode')
-        if not short_code or short_code not in url_store:
-            return jsonify(error='Short code not found'), 404
-        # Update entry fields (allow archiving)
-        fields = ['originalUrl', 'archived']
-        updated = False
-        for f in fields:
-            if f in data:
-                url_store[short_code][f] = data[f]
-                updated = True
-        if updated:
-            save_data()
-            return jsonify(success=True)
-        return jsonify(error='No valid fields provided'), 400
+        body, status = update_link(data.get('shortCode'), data)
+        return jsonify(body), status
 
     elif request.method == 'DELETE':
-        short_code = data.get('shortCode')
-        if not short_code or short_code not in url_store:
-            return jsonify(error='Short code not found'), 404
-        del url_store[short_code]
-        save_data()
-        return jsonify(success=True)
+        body, status = delete_link(data.get('shortCode'))
+        return jsonify(body), status
+
+
+@app.route('/api/urls/<short_code>/clicks')
+def api_url_clicks(short_code):
+    # Click total plus per-minute counts between ?from= and ?to= (epoch
+    # seconds, default the last 24 hours). Lags by up to URL_CLICK_INTERVAL.
+    if clicks is None:
+        return jsonify(error='Click tracking is disabled'), 404
+    if short_code not in store:
+        return jsonify(error='Short code not found'), 404
+    now = time.time()
+    try:
+        start = float(request.args.get('from', now - 86400))
+        end = float(request.args.get('to', now))
+    except ValueError:
+        return jsonify(error='Invalid time range'), 400
+    # droppedClicks: hits this process discarded because its buffer was full
+    return jsonify(dict(clicks.history(short_code, start, end), droppedClicks=clicks.dropped))
+
+
+@app.route('/api/urls/<short_code>/uniques')
+def api_url_uniques(short_code):
+    # Estimated unique visitors between ?from= and ?to= (epoch seconds,
+    # default the last 24 hours), widened to whole URL_UNIQUES_WINDOWs.
+    if clicks is None:
+        return jsonify(error='Click tracking is disabled'), 404
+    if short_code not in store:
+        return jsonify(error='Short code not found'), 404
+    now = time.time()
+    try:
+        start = float(request.args.get('from', now - 86400))
+        end = float(request.args.get('to', now))
+    except ValueError:
+        return jsonify(error='Invalid time range'), 400
+    return jsonify(clicks.uniques(short_code, start, end))
+
+
+@app.route('/api/trending')
+def api_trending():
+    # Most-clicked codes over ?window= (1m, 1h or 1d), top ?k= of them.
+    # Counts come with error bounds; see trending.SlidingTopK.
+    if trending is None:
+        return jsonify(error='Click tracking is disabled'), 404
+    window = request.args.get('window', '1h')
+    if window not in trending.windows:
+        return jsonify(error='Unknown window'), 400
+    try:
+        k = int(request.args.get('k', 100))
+    except ValueError:
+        return jsonify(error='Invalid k'), 400
+    if not 0 < k <= TRENDING_CAPACITY:
+        return jsonify(error='k must be between 1 and %d' % TRENDING_CAPACITY), 400
+    return jsonify(trending.top(window, k))
+
+
+@app.route('/api/purges')
+def api_purges():
+    # Codes to purge from edge caches, oldest first, after position `after`
+    # (the `next` of the previous call; 0 or absent for the start)
+    if purge_log is None:
+        return jsonify(error='Purge log is disabled'), 404
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', 1000))
+    except ValueError:
+        return jsonify(error='after and limit must be integers'), 400
+    if after < 0 or not 0 < limit <= MAX_PAGE:
+        return jsonify(error='after must be >= 0 and limit between 1 and %d' % MAX_PAGE), 400
+    entries, position = purge_log.read(after, limit)
+    return jsonify(purges=entries, next=position)
+
+
+# Operations applied (and persisted) together in one bulk request chunk
+BATCH_CHUNK = int(os.environ.get("URL_BATCH_CHUNK", "1000"))
+
+
+def apply_batch_op(op):
+    if op is MALFORMED:
+        return dict(error='Malformed request body'), 400
+    if not isinstance(op, dict):
+        return dict(error='Operation must be an object'), 400
+    kind = op.get('op', 'create')
+    if kind == 'create':
+        expires_at, error = parse_expiry(op)
+        if not error:
+            policy, error = parse_policy(op)
+        if error:
+            return dict(error=error), 400
+        return create_link(op.get('originalUrl', ''), None if expires_at is MISSING else expires_at, policy)
+    elif kind == 'update':
+        return update_link(op.get('shortCode'), op)
+    elif kind == 'delete':
+        return delete_link(op.get('shortCode'))
+    return dict(error='Unknown operation'), 400
+
+
+def run_batch(ops):
+    # Apply ops chunk by chunk, persisting once per chunk, and yield one
+    # result per op in input order.
+    index = 0
+    for chunk in chunked(guarded(ops), BATCH_CHUNK):
+        results = []
+        with store.batch():
+            for op in chunk:
+                body, status = apply_batch_op(op)
+                results.append(dict(body, index=index, status=status))
+                index += 1
+        yield from results
+
+
+@app.route('/api/urls/batch', methods=['POST'])
+def api_urls_batch():
+    # Body is either a JSON array of operations or NDJSON (one per line):
+    #   {"op": "create", "originalUrl": ...}
+    #   {"op": "update", "shortCode": ..., "originalUrl"/"archived"/"maxAge"/...: ...}
+    #   {"op": "delete", "shortCode": ...}
+    # Results stream back in the same format, one per operation.
+    ndjson = request.mimetype in ('application/x-ndjson', 'application/jsonl')
+    ops = iter_ndjson(request.stream) if ndjson else iter_json_array(request.stream)
+
+    def generate():
+        if ndjson:
+            for result in run_batch(ops):
+                yield json.dumps(result) + '\n'
+        else:
+            yield '['
+            for i, result in enumerate(run_batch(ops)):
+                yield (',' if i else '') + json.dumps(result)
+            yield ']'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
 
 if __name__ == '__main__':